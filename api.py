@@ -0,0 +1,42 @@
+from flask import Blueprint, g, jsonify, request
+from batch import BatchError, load_batch, run_batch
+from versioning import org_conditional
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+@api.errorhandler(BatchError)
+def handle_batch_error(e):
+    '''reports a malformed batch request as JSON'''
+    return jsonify(error=str(e)), 400
+
+@api.before_request
+def require_user():
+    '''answers unauthenticated API requests with 401 instead of redirecting to the login page'''
+    if not g.user:
+        return jsonify(error='Access Unauthorized'), 401
+
+@api.route('/profiles')
+@org_conditional
+def get_profiles():
+    '''returns the org's profiles named by ?ids=1,2,3 with their primary role, limited to ?fields=... if given'''
+    return jsonify(load_batch(g.user.organization_id, 'profiles', request.args.get('ids'), request.args.get('fields')))
+
+@api.route('/companies')
+@org_conditional
+def get_companies():
+    '''returns the org's companies named by ?ids=1,2,3, limited to ?fields=... if given'''
+    return jsonify(load_batch(g.user.organization_id, 'companies', request.args.get('ids'), request.args.get('fields')))
+
+@api.route('/maps')
+@org_conditional
+def get_maps():
+    '''returns the org's maps named by ?ids=1,2,3, limited to ?fields=... if given'''
+    return jsonify(load_batch(g.user.organization_id, 'maps', request.args.get('ids'), request.args.get('fields')))
+
+@api.route('/batch', methods=['POST'])
+def post_batch():
+    '''returns profiles, companies and maps named in a JSON body of {type: {"ids": [...], "fields": [...]}} in one call'''
+    body = request.get_json(silent=True)
+    if body is None:
+        raise BatchError('Expected a JSON body')
+    return jsonify(run_batch(g.user.organization_id, body))
@@ -1,52 +1,221 @@
-from flask import Flask, session, g, redirect, render_template, flash, jsonify, request
-from flask_mail import Mail, Message
+from flask import Flask, Blueprint, abort, current_app, g, redirect, render_template, flash, jsonify, request
 from secret import GMAIL_USERNAME, GMAIL_PASSWORD, SECRET_KEY
 from flask_debugtoolbar import DebugToolbarExtension
-from models import db, connect_db, User, Organization, PendingUser, Company, Profile, Role, Function, Level, RoleFunction, Map
+from models import db, connect_db, User, Organization, PendingUser, Company, Profile, ProfileSearch, CompanyTransition, Map, MapCell
 from sqlalchemy.exc import IntegrityError
-from forms import FirstAdminForm, InviteUserForm, RegisterUserForm, LoginForm, CompanyForm, ProfileForm, MapForm
-from seed import should_seed, seed_functions, seed_levels, seed_states, seed_countries
+from forms import FirstAdminForm, InviteUserForm, RegisterUserForm, LoginForm, CompanyForm, ProfileForm, ProfileImportForm, MapForm
+from seed import seed_reference_data
 from security import generate_token, calculate_expiration
+from company_index import company_index, DEFAULT_LIMIT, MAX_LIMIT
+from pagination import paginate_args
+from company_detail import load_company_members
+from profile_detail import load_profile, primary_role
+from talent_flow import top_flows, FLOW_LIMIT, MAX_FLOW_LIMIT
+from profile_search import search_profiles, DEFAULT_LIMIT as SEARCH_LIMIT, MAX_LIMIT as MAX_SEARCH_LIMIT
+from dashboard import get_dashboard, invalidate_dashboard
+from reference import reference_data
+from importer import import_profiles
+from profiles import create_profile, ProfileError
+from mailer import mail, enqueue_email, run_worker
+from migrate import run_migrations
+from partitioning import partition_tables, plan_partitioning, partition_layout, dropped_foreign_keys, PartitionError, STRATEGIES as PARTITION_STRATEGIES, DEFAULT_PARTITIONS
+from generator import generate_organization, PASSWORD as GENERATED_PASSWORD
+from benchmark import run_benchmark, save_results, load_results, compare_results, ITERATIONS as BENCHMARK_ITERATIONS
+from instrumentation import sql_instrumentation, SLOW_REQUEST_MS
+from routing import replica_router, use_primary, REPLICA_BIND, STICKY_SECONDS
+from versioning import record_org_write, record_org_writes, org_conditional
+from api import api
+from assets import asset_pipeline
+from identity import CURR_USER_KEY, IDENTITY_MAX_AGE, login_user, logout_user, load_current_user, refresh_current_user
 from datetime import datetime
-from sqlalchemy import or_
+import click
+import io
 import os
 
-CURR_USER_KEY = "curr_user"
 BASE_URL = 'https://talenttree.onrender.com'
 
-app = Flask(__name__)
+PROFILE_SORTS = {
+    'name': ([Profile.last_name, Profile.first_name, Profile.id], False),
+    'recent': ([Profile.id], True)
+}
+COMPANY_SORTS = {
+    'name': ([Company.name, Company.id], False),
+    'recent': ([Company.id], True)
+}
+
+bp = Blueprint('main', __name__, cli_group=None)
+
+def create_app(config=None):
+    '''creates and configures an app without touching the database; run `flask init-db` to create the schema and seed it'''
+    app = Flask(__name__)
+
+    app.config['SECRET_KEY']= SECRET_KEY
+    app.config['SQLALCHEMY_DATABASE_URI'] = (
+        os.environ.get('DATABASE_URL', 'postgresql:///talenttree'))
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS']=False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true') == 'true'
+    }
+    if os.environ.get('DATABASE_REPLICA_URL'):
+        app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: os.environ['DATABASE_REPLICA_URL']}
+    app.config['DB_REPLICA_STICKY_SECONDS'] = int(os.environ.get('DB_REPLICA_STICKY_SECONDS', STICKY_SECONDS))
+    app.config['SQLALCHEMY_ECHO'] = os.environ.get('SQLALCHEMY_ECHO') == 'true'
+    app.config['SQL_SLOW_REQUEST_MS'] = int(os.environ.get('SQL_SLOW_REQUEST_MS', SLOW_REQUEST_MS))
+    if os.environ.get('SQL_TIMING_HEADERS'):
+        app.config['SQL_TIMING_HEADERS'] = os.environ['SQL_TIMING_HEADERS'] == 'true'
+    app.config['IDENTITY_MAX_AGE'] = int(os.environ.get('IDENTITY_MAX_AGE', IDENTITY_MAX_AGE))
+    app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 0)) or None
+    app.config['BCRYPT_TARGET_MS'] = int(os.environ.get('BCRYPT_TARGET_MS', 250))
+    app.config['BCRYPT_MAX_CONCURRENCY'] = int(os.environ.get('BCRYPT_MAX_CONCURRENCY', 4))
+
+    app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+    app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
+    app.config['MAIL_USE_TLS']  = os.environ.get('MAIL_USE_TLS', 'true') == 'true'
+    app.config['MAIL_USERNAME'] = GMAIL_USERNAME
+    app.config['MAIL_PASSWORD'] = GMAIL_PASSWORD
+    app.config['MAIL_DEFAULT_SENDER'] = GMAIL_USERNAME
+
+    if config:
+        app.config.update(config)
 
-app.config['SECRET_KEY']= SECRET_KEY
-debug=DebugToolbarExtension(app)
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgresql:///talenttree'))
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS']=False
-app.config['SQLALCHEMY_ECHO'] = True
-
-app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS']  = True
-app.config['MAIL_USERNAME'] = GMAIL_USERNAME
-app.config['MAIL_PASSWORD'] = GMAIL_PASSWORD
-
-mail = Mail(app)
-
-with app.app_context():
     connect_db(app)
-
-with app.app_context():
-    if should_seed():
-        seed_functions()
-        seed_levels()
-        seed_states()
-        seed_countries()
+    mail.init_app(app)
+    sql_instrumentation.init_app(app)
+    replica_router.init_app(app)
+    asset_pipeline.init_app(app)
+    if app.debug:
+        DebugToolbarExtension(app)
+    app.register_blueprint(bp)
+    app.register_blueprint(api)
+    return app
+
+@bp.cli.command('init-db')
+def init_db():
+    '''creates missing tables, applies pending migrations, seeds the reference data if it is empty and fills the map cells if none are stored'''
+    db.create_all()
+    for version in run_migrations():
+        click.echo(f'Applied {version}')
+    if seed_reference_data():
+        click.echo('Seeded reference data')
+    reference_data.reload()
+    maps = [] if db.session.query(MapCell.query.exists()).scalar() else Map.refresh_all_cells()
+    if maps:
+        record_org_writes(list({map.organization_id for map in maps}))
+        db.session.commit()
+        click.echo('Filled map cells')
+
+@bp.cli.command('upgrade-db')
+def upgrade_db():
+    '''creates missing tables and applies pending schema migrations, some of which index tables only create_all makes'''
+    db.create_all()
+    for version in run_migrations():
+        click.echo(f'Applied {version}')
+
+@bp.cli.command('partition-db')
+@click.option('--strategy', type=click.Choice(PARTITION_STRATEGIES), default='hash', help='hash spreads organizations over a fixed number of partitions, list gives each --org its own')
+@click.option('--partitions', type=int, default=DEFAULT_PARTITIONS, help='number of hash partitions')
+@click.option('--org', 'organization_ids', type=int, multiple=True, help='organization to give its own list partition; repeatable')
+@click.option('--dry-run', is_flag=True, help='print the statements instead of running them')
+def partition_db(strategy, partitions, organization_ids, dry_run):
+    '''moves companies, profiles and roles into tables partitioned by organization, keeping their rows'''
+    with db.engine.connect() as connection:
+        for table, name, definition in dropped_foreign_keys(connection):
+            click.echo(f'Warning: dropping {table}.{name} {definition}', err=True)
+    try:
+        if dry_run:
+            with db.engine.connect() as connection:
+                for statement in plan_partitioning(connection, strategy, partitions, organization_ids):
+                    click.echo(f'{statement};')
+            return
+        partition_tables(strategy, partitions, organization_ids)
+    except PartitionError as e:
+        raise click.UsageError(str(e))
+    with db.engine.connect() as connection:
+        for table, (key, count) in partition_layout(connection).items():
+            click.echo(f'{table}: {key} in {count} partitions')
+
+@bp.cli.command('refresh-map-cells')
+def refresh_map_cells():
+    '''rebuilds the stored cells of every contact map'''
+    maps = Map.refresh_all_cells()
+    record_org_writes(list({map.organization_id for map in maps}))
+    db.session.commit()
+
+@bp.cli.command('refresh-profile-search')
+def refresh_profile_search():
+    '''rebuilds the full-text search rows of every profile'''
+    ProfileSearch.refresh()
+    record_org_writes()
+    db.session.commit()
+
+@bp.cli.command('rebuild-talent-flows')
+@click.option('--org', 'organization_id', type=int, default=None, help='only rebuild one organization')
+def rebuild_talent_flows(organization_id):
+    '''recomputes the company to company transition counts from role histories'''
+    CompanyTransition.rebuild(organization_id)
+    record_org_writes(None if organization_id is None else [organization_id])
+    db.session.commit()
+
+@bp.cli.command('import-profiles')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--org', 'organization_id', type=int, required=True, help='organization to import into')
+def import_profiles_command(path, organization_id):
+    '''imports profiles from a CSV or JSONL file'''
+    format = 'jsonl' if path.endswith('.jsonl') else 'csv'
+    with open(path, newline='', encoding='utf-8-sig') as stream:
+        result = import_profiles(stream, organization_id, format)
+    click.echo(f'Created {result.created} profiles')
+    for line, message in result.errors:
+        click.echo(f'Line {line}: {message}', err=True)
+
+@bp.cli.command('send-email')
+@click.option('--once', is_flag=True, help='send one batch and exit')
+@click.option('--poll', 'poll_interval', type=float, default=5, help='seconds to wait when the outbox is empty')
+def send_email_command(once, poll_interval):
+    '''delivers queued outbox email, running until stopped unless --once is given'''
+    sent = run_worker(poll_interval, once)
+    if once:
+        click.echo(f'Sent {sent} emails')
+
+@bp.cli.command('generate-data')
+@click.option('--name', required=True, help='name of the organization to create')
+@click.option('--companies', type=int, default=200)
+@click.option('--profiles', type=int, default=2000)
+@click.option('--max-roles', type=int, default=4, help='most roles in one profile\'s history')
+@click.option('--maps', type=int, default=10)
+@click.option('--seed', type=int, default=None, help='random seed for a repeatable dataset')
+def generate_data_command(name, companies, profiles, max_roles, maps, seed):
+    '''creates a synthetic organization for load testing'''
+    generated = generate_organization(name, companies, profiles, max_roles, maps, seed=seed)
+    invalidate_dashboard(generated.organization_id)
+    click.echo(f'Created organization #{generated.organization_id}; log in as {generated.email} / {GENERATED_PASSWORD}')
+
+@bp.cli.command('benchmark')
+@click.option('--org', 'organization_id', type=int, required=True, help='organization to benchmark as its admin')
+@click.option('--iterations', type=int, default=BENCHMARK_ITERATIONS)
+@click.option('--output', type=click.Path(dir_okay=False), help='file to write JSON results to')
+@click.option('--compare', 'baseline', type=click.Path(exists=True, dir_okay=False), help='earlier results to compare against')
+def benchmark_command(organization_id, iterations, output, baseline):
+    '''measures latency percentiles and query counts of the main routes'''
+    results = run_benchmark(current_app._get_current_object(), organization_id, iterations)
+    for name, result in results['routes'].items():
+        click.echo(f"{name:16} p50 {result['p50_ms']:8.2f}ms  p90 {result['p90_ms']:8.2f}ms  p99 {result['p99_ms']:8.2f}ms  {result['queries']:4} queries")
+    if baseline:
+        click.echo('')
+        for name, before, after, change, before_queries, after_queries in compare_results(load_results(baseline), results):
+            click.echo(f'{name:16} p50 {before:8.2f}ms -> {after:8.2f}ms ({change:+.1f}%)  queries {before_queries} -> {after_queries}')
+    if output:
+        save_results(results, output)
 
 def email_registration(email, token):
-    '''sends email to pending user so that they can sign up using the token-embedded link'''
+    '''queues email to pending user so that they can sign up using the token-embedded link'''
 
-    msg = mail.send_message(
+    enqueue_email(
         'Time Sensitive: Welcome to talentTree!',
-        sender = GMAIL_USERNAME,
         recipients = [email],
         body=f'''
 Welcome to talentTree! Please click the following link within 24 hours to complete registration: 
@@ -55,11 +224,10 @@ Welcome to talentTree! Please click the following link within 24 hours to comple
     )
 
 def email_confirm_registration(email):
-    '''sends email to new user verifying successful signup'''
+    '''queues email to new user verifying successful signup'''
 
-    msg = mail.send_message(
+    enqueue_email(
         'Registration Successful',
-        sender = GMAIL_USERNAME,
         recipients = [email],
         body=f'''
 Welcome to talentTree!
@@ -77,26 +245,24 @@ Thank you again!
 def do_login(user):
     """Log in user."""
 
-    session[CURR_USER_KEY] = user.email
+    login_user(user)
 
 
 def do_logout():
     """Logout user."""
 
-    if CURR_USER_KEY in session:
-        del session[CURR_USER_KEY]
+    logout_user()
 
-@app.before_request
+@bp.before_app_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
-
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+    """If we're logged in, add curr user to Flask global from the session snapshot."""
 
-    else:
+    if request.endpoint == 'static':
         g.user = None
+    else:
+        g.user = load_current_user(current_app.config['IDENTITY_MAX_AGE'])
 
-@app.route('/')
+@bp.route('/')
 def home():
     '''displays info page or redirects to user's org home'''
 
@@ -105,7 +271,7 @@ def home():
     else:
         return render_template('home.html')
     
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     '''renders login form and handles submission'''
     form = LoginForm()
@@ -121,7 +287,7 @@ def login():
             form.email.errors = ['Invalid username/password.']
     return render_template('login.html', form=form)
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     '''logs out user'''
     do_logout()
@@ -129,7 +295,7 @@ def logout():
     return redirect('/')
 
 
-@app.route('/signup', methods=['GET', 'POST'])
+@bp.route('/signup', methods=['GET', 'POST'])
 def register_first_admin():
     '''displays form to register new admin-user and their organization and handles submit'''
 
@@ -150,19 +316,19 @@ def register_first_admin():
                 organization_id= Organization.query.filter_by(name=form.organization.data).first().id
                 )
             db.session.add(user)
+            email_confirm_registration(user.email)
             db.session.commit()
         except IntegrityError:
             flash("Username already taken", 'danger')
             return render_template('admin-register.html', form=form)
         do_login(user)
-        email_confirm_registration(user.email)
         return redirect(f'/organizations/{org.id}')
     else:
         return render_template('admin-register.html', form=form)
     
-@app.route('/organizations/<int:org_id>')
+@bp.route('/organizations/<int:org_id>')
 def org_homepage(org_id):
-    '''displays an organization's homepage'''
+    '''displays an organization's homepage dashboard'''
 
     if not g.user or g.user.organization_id != org_id:
         flash("Access Unauthorized", 'danger')
@@ -171,14 +337,14 @@ def org_homepage(org_id):
     else:
         org = Organization.query.get_or_404(org_id)
         users = org.users
-        companies = Company.query.filter_by(organization_id=g.user.organization_id).all()
-        profiles = Profile.query.filter_by(organization_id=g.user.organization_id).all()
-        return render_template('org-home.html', org=org, companies=companies, profiles=profiles, users=users)        
+        dashboard = get_dashboard(org_id)
+        return render_template('org-home.html', org=org, users=users, dashboard=dashboard)        
     
-@app.route('/invite', methods=['GET', 'POST'])
+@bp.route('/invite', methods=['GET', 'POST'])
 def invite_users():
     '''returns a form allowing admin to invite others to their organization'''
 
+    g.user = refresh_current_user()
     if not g.user or not g.user.is_admin:
         flash("Access Unauthorized", 'danger')
         return redirect('/')
@@ -202,8 +368,8 @@ def invite_users():
                 expiration = calculate_expiration()
             )
             db.session.add(pending_user)
-            db.session.commit()
             email_registration(email, pending_user.token)
+            db.session.commit()
             flash(f'Successfully invited {email}', 'success')
             return redirect('/invite')
         except ValueError:
@@ -211,7 +377,8 @@ def invite_users():
             return render_template('invite-user.html', form=form)   
     return render_template('invite-user.html', form=form)
 
-@app.route('/register/<token>', methods=['GET', 'POST'])
+@bp.route('/register/<token>', methods=['GET', 'POST'])
+@use_primary
 def token_registration(token):
     '''allows a new user to register from an emailed link and handles submission'''
     pending_user = PendingUser.query.filter_by(token=token).first()
@@ -241,7 +408,7 @@ def token_registration(token):
     flash("Invalid Token")
     return redirect('/')
 
-@app.route('/companies/new', methods=['GET', 'POST'])
+@bp.route('/companies/new', methods=['GET', 'POST'])
 def show_and_handle_company_form():
     '''renders form to create new company and redirects to company on creation'''
     if not g.user:
@@ -254,7 +421,10 @@ def show_and_handle_company_form():
             domain = form.domain.data
             new_co = Company(name=name, domain=domain, organization_id=g.user.organization_id)
             db.session.add(new_co)
+            record_org_write(g.user.organization_id)
             db.session.commit()
+            company_index.add(new_co)
+            invalidate_dashboard(g.user.organization_id)
             return redirect(f'/companies/{new_co.id}')
 
         except IntegrityError:
@@ -263,7 +433,8 @@ def show_and_handle_company_form():
                 return render_template('company-form.html', form=form)
     return render_template('company-form.html', form=form)
 
-@app.route('/companies/<int:co_id>')
+@bp.route('/companies/<int:co_id>')
+@org_conditional
 def show_company(co_id):
     '''shows company details'''
     co = Company.query.get_or_404(co_id)
@@ -271,21 +442,43 @@ def show_company(co_id):
         flash("Access Unauthorized", 'danger')
         return redirect('/')
     else:
-        employees = co.employees
-        alumni = co.alumni
-        return render_template('company-detail.html', company = co, employees=employees, alumni=alumni)
+        members = load_company_members(co.id, request.args)
+        flows = top_flows(co.id)
+        return render_template('company-detail.html', company = co, employees=members['employees'], alumni=members['alumni'], flows=flows)
+
+@bp.route('/api/companies/<int:co_id>/flows')
+@org_conditional
+def api_company_flows(co_id):
+    '''returns the companies people most often move to from a company and come to it from via JSON'''
+    co = Company.query.get_or_404(co_id)
+    if not g.user or g.user.organization_id != co.organization_id:
+        flash("Access Unauthorized", 'danger')
+        return redirect('/')
+    limit = max(1, min(request.args.get('limit', FLOW_LIMIT, type=int), MAX_FLOW_LIMIT))
+    return jsonify(top_flows(co.id, limit))
 
-@app.route('/companies')
+@bp.route('/companies')
+@org_conditional
 def list_companies():
-    '''shows an org's list of companies'''
+    '''shows a page of an org's list of companies'''
     if not g.user:
         flash("Access Unauthorized", 'danger')
         return redirect('/')
-    companies = Company.query.filter_by(organization_id=g.user.organization_id).all()
+    companies = paginate_args(Company.query.filter_by(organization_id=g.user.organization_id), COMPANY_SORTS, request.args)
     org = Organization.query.get_or_404(g.user.organization_id)
     return render_template('companies.html', companies=companies, org=org)
 
-@app.route('/profiles/new', methods=['GET', 'POST'])
+@bp.route('/api/companies')
+@org_conditional
+def api_list_companies():
+    '''returns a page of an org's companies via JSON'''
+    if not g.user:
+        flash("Access Unauthorized", 'danger')
+        return redirect('/')
+    companies = paginate_args(Company.query.filter_by(organization_id=g.user.organization_id), COMPANY_SORTS, request.args)
+    return jsonify(companies=[c.serialize() for c in companies.items], next=companies.next_cursor)
+
+@bp.route('/profiles/new', methods=['GET', 'POST'])
 def show_and_handle_profile_form():
     '''renders form to create new profile and redirects to profile on creation'''
     if not g.user:
@@ -294,96 +487,122 @@ def show_and_handle_profile_form():
     form = ProfileForm()
     if form.validate_on_submit():
         try:
-            valid_domain = Company.query.filter(
-                (Company.domain == form.company.data) &
-                (Company.organization_id == g.user.organization_id)
-            ).first()
-            if not valid_domain:
-                form.company.errors.append('No company exists')
-                return render_template('profile-form.html', form=form)
-            new_profile = Profile(
-                first_name = form.first_name.data,
-                last_name = form.last_name.data,
-                linkedin_url = form.linkedin_url.data,
-                headline = form.headline.data,
-                organization_id = g.user.organization_id,
-                city = form.city.data,
-                state_id=form.state.data if form.state.data != 'None' else None,
-                country_id = form.country.data
-            )
-            db.session.add(new_profile)
-            db.session.commit()
-        except IntegrityError as e:
-                db.session.rollback()
-                flash("Error: {}".format(str(e)), 'danger')
-                flash("Profile already exists", 'danger')
-                return render_template('profile-form.html', form=form)
-        try:
-            new_role = Role(
-                company_id = Company.query.filter_by(domain=form.company.data).first().id,
-                level_id = Level.query.filter_by(name=form.level.data).first().id,
-                profile_id = new_profile.id,
-                start_date = form.start_date.data,
-                end_date = None,
-                is_primary = True
-            )
-            db.session.add(new_role)
-            db.session.commit()
-            functions = form.functions.data
-            for f in functions:
-                function_id = Function.query.filter_by(name=f).first().id
-                role_function = RoleFunction(
-                    role_id = new_role.id,
-                    function_id = function_id
-                    )
-                db.session.add(role_function)
-            db.session.commit()
-        except IntegrityError:
-            db.session.rollback()
-            flash("Problem creating role or functions", 'danger')
+            new_profile = create_profile(g.user.organization_id, {
+                'first_name': form.first_name.data,
+                'last_name': form.last_name.data,
+                'linkedin_url': form.linkedin_url.data,
+                'headline': form.headline.data,
+                'company': form.company.data,
+                'level': form.level.data,
+                'functions': form.functions.data,
+                'start_date': form.start_date.data,
+                'city': form.city.data,
+                'state': form.state.data if form.state.data != 'None' else None,
+                'country': form.country.data
+            })
+        except ProfileError as e:
+            field = getattr(form, e.field, None) if e.field else None
+            if field is not None:
+                field.errors.append(str(e))
+            else:
+                flash(str(e), 'danger')
             return render_template('profile-form.html', form=form)
         return redirect(f'/profiles/{new_profile.id}')
     else:
         return render_template('profile-form.html', form=form)
             
-@app.route('/profiles')
+@bp.route('/profiles/import', methods=['GET', 'POST'])
+def show_and_handle_profile_import():
+    '''renders form to upload a file of profiles and reports the rows that could not be imported'''
+    if not g.user:
+        flash("Access Unauthorized", 'danger')
+        return redirect('/')
+    form = ProfileImportForm()
+    if form.validate_on_submit():
+        upload = form.file.data
+        format = 'jsonl' if upload.filename.lower().endswith('.jsonl') else 'csv'
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        result = import_profiles(stream, g.user.organization_id, format)
+        flash(f'Imported {result.created} profiles', 'success')
+        return render_template('profile-import.html', form=ProfileImportForm(formdata=None), result=result)
+    return render_template('profile-import.html', form=form, result=None)
+
+@bp.route('/profiles')
+@org_conditional
 def list_profiles():
-    '''lists all profiles in an organization'''
+    '''lists a page of the profiles in an organization'''
     if not g.user:
         flash("Access Unauthorized", 'danger')
         return redirect('/')
-    profiles = Profile.query.filter_by(organization_id=g.user.organization_id)
+    profiles = paginate_args(Profile.query.filter_by(organization_id=g.user.organization_id), PROFILE_SORTS, request.args)
     org = Organization.query.get_or_404(g.user.organization_id)
     return render_template('profiles.html', profiles=profiles, org=org)
 
-@app.route('/profiles/<int:profile_id>')
+@bp.route('/api/profiles')
+@org_conditional
+def api_list_profiles():
+    '''returns a page of an org's profiles via JSON'''
+    if not g.user:
+        flash("Access Unauthorized", 'danger')
+        return redirect('/')
+    profiles = paginate_args(Profile.query.filter_by(organization_id=g.user.organization_id), PROFILE_SORTS, request.args)
+    return jsonify(profiles=[p.serialize() for p in profiles.items], next=profiles.next_cursor)
+
+@bp.route('/api/profiles/search')
+@org_conditional
+def api_search_profiles():
+    '''searches an org's profiles by name, headline, city and current company with optional level, function and country filters'''
+    if not g.user:
+        flash("Access Unauthorized", 'danger')
+        return redirect('/')
+    limit = max(1, min(request.args.get('limit', SEARCH_LIMIT, type=int), MAX_SEARCH_LIMIT))
+    profiles = search_profiles(
+        g.user.organization_id,
+        request.args.get('q', ''),
+        level=request.args.get('level'),
+        function=request.args.get('function'),
+        country=request.args.get('country'),
+        limit=limit
+    )
+    return jsonify(profiles=profiles)
+
+@bp.route('/profiles/<int:profile_id>')
+@org_conditional
 def show_profile(profile_id):
-    profile = Profile.query.get_or_404(profile_id)
+    '''shows a profile with its primary role and career history'''
+    profile = load_profile(profile_id)
+    if profile is None:
+        abort(404)
     if not g.user or g.user.organization_id != profile.organization_id:
         flash("Access Unauthorized", 'danger')
         return redirect('/')
-    primary_role = profile.primary_role()
-    functions = primary_role.functions
-    return render_template('profile.html', profile=profile, primary_role=primary_role, functions=functions)
+    role = primary_role(profile)
+    functions = role.functions if role else []
+    return render_template('profile.html', profile=profile, primary_role=role, functions=functions)
 
-@app.route('/api/companies/search')
+@bp.route('/api/companies/search')
+@org_conditional
 def company_search():
-    '''searches for companies by name and domain name and returns via JSON'''
+    '''searches the organization's company index by name and domain name and returns ranked domains via JSON, or names and domains with ?detail=1'''
 
     if not g.user:
         flash("Access Unauthorized", 'danger')
         return redirect('/')
 
-    search_term = request.args.get('q')
-    search_results = Company.query.filter(
-        (Company.organization_id == g.user.organization_id) &
-        (or_(Company.name.ilike(f'%{search_term}'), Company.domain.ilike(f'%{search_term}%')))
-    ).all()
+    search_term = request.args.get('q', '')
+    limit = min(request.args.get('limit', DEFAULT_LIMIT, type=int), MAX_LIMIT)
+    if request.args.get('detail') == '1':
+        # one extra match tells the typeahead whether the list is complete enough to filter locally
+        search_results = company_index.search(g.user.organization_id, search_term, limit + 1)
+        companies = [{'name': name, 'domain': domain} for name, domain in search_results[:limit]]
+        return jsonify(companies=companies, complete=len(search_results) <= limit)
+    search_results = company_index.search(g.user.organization_id, search_term, limit)
 
-    response = [company.domain for company in search_results]
+    response = [domain for name, domain in search_results]
     return jsonify(response)
 
-@app.route('/maps')
+@bp.route('/maps')
+@org_conditional
 def list_maps():
     '''lists all maps in an organization'''
     if not g.user:
@@ -393,7 +612,7 @@ def list_maps():
     org = g.user.organization
     return render_template('maps.html', maps=maps, org=org)
 
-@app.route('/maps/new', methods=['GET', 'POST'])
+@bp.route('/maps/new', methods=['GET', 'POST'])
 def show_and_handle_map_form():
     '''renders form to create new map and redirects to map on creation'''
     if not g.user:
@@ -404,14 +623,18 @@ def show_and_handle_map_form():
     if form.validate_on_submit():
         try:
             new_map = Map(name=form.name.data, 
-                          level_id=Level.query.filter_by(name=form.level.data).first().id, 
+                          level_id=reference_data.level_id(form.level.data), 
                           organization_id=g.user.organization_id)
             function_names = request.form.getlist('functions')
-            new_map.functions = Function.query.filter(Function.name.in_(function_names)).all()
+            new_map.functions = reference_data.session_functions(function_names)
             company_ids = request.form.getlist('companies')
             new_map.companies = Company.query.filter(Company.id.in_(company_ids), Company.organization_id == g.user.organization_id).all()
             db.session.add(new_map)
+            db.session.flush()
+            new_map.refresh_cells()
+            record_org_write(g.user.organization_id)
             db.session.commit()
+            invalidate_dashboard(g.user.organization_id)
             return redirect(f'/maps/{new_map.id}')
         except IntegrityError:
             db.session.rollback()
@@ -420,7 +643,8 @@ def show_and_handle_map_form():
     else:
         return render_template('map-form.html', form=form, companies=company_options)
     
-@app.route('/maps/<int:map_id>')
+@bp.route('/maps/<int:map_id>')
+@org_conditional
 def show_map(map_id):
     '''displays a map of companies and their selected roles'''
     map = Map.query.get_or_404(map_id)
@@ -432,7 +656,7 @@ def show_map(map_id):
     rows = map.generate_map_rows()
     return render_template('map-detail.html', map=map, headers=headers, rows=rows)
 
-@app.route('/maps/<int:map_id>/edit', methods=['GET', 'POST'])
+@bp.route('/maps/<int:map_id>/edit', methods=['GET', 'POST'])
 def edit_map(map_id):
     '''renders form to edit map and redirects to map on submit'''
     map = Map.query.get_or_404(map_id)
@@ -444,25 +668,44 @@ def edit_map(map_id):
     company_options = Company.query.filter_by(organization_id=g.user.organization_id)
     selected_company_ids = [c.id for c in map.companies]
     if form.validate_on_submit():
+        old_level_id = map.level_id
+        old_function_ids = [f.id for f in map.functions]
         map.name = form.name.data
-        map.level_id = Level.query.filter_by(name=form.level.data).first().id
+        map.level_id = reference_data.level_id(form.level.data)
         function_names = request.form.getlist('functions')
-        map.functions = Function.query.filter(Function.name.in_(function_names)).all()
+        map.functions = reference_data.session_functions(function_names)
         company_ids = request.form.getlist('companies')
         map.companies = Company.query.filter(Company.id.in_(company_ids), Company.organization_id == g.user.organization_id).all()
+        db.session.flush()
+        map.sync_cells(old_level_id, selected_company_ids, old_function_ids)
+        record_org_write(g.user.organization_id)
         db.session.commit()
+        invalidate_dashboard(g.user.organization_id)
         return redirect(f'/maps/{map_id}')
     else:
         return render_template('map-edit.html', map=map, form=form, companies=company_options, function_names=function_names, selected_company_ids=selected_company_ids)
     
-@app.route('/maps/<int:map_id>/delete', methods=['POST'])
+@bp.route('/maps/<int:map_id>/delete', methods=['POST'])
 def delete_map(map_id):
     '''deletes the map and redirects to maps'''
     map = Map.query.get_or_404(map_id)
-    if not g.user.is_admin or map.organization_id != g.user.organization_id:
+    g.user = refresh_current_user()
+    if not g.user or not g.user.is_admin or map.organization_id != g.user.organization_id:
         flash("Access Unauthorized", 'danger')
         return redirect('/')
     else:
         db.session.delete(map)
+        record_org_write(g.user.organization_id)
         db.session.commit()
-        return redirect('/maps')
\ No newline at end of file
+        invalidate_dashboard(g.user.organization_id)
+        return redirect('/maps')
+
+@bp.route('/debug/requests')
+def show_recent_requests():
+    '''shows query counts, database time and slowest statements of the organization's recent requests to admins'''
+    g.user = refresh_current_user()
+    if not g.user or not g.user.is_admin:
+        flash("Access Unauthorized", 'danger')
+        return redirect('/')
+    recent = sql_instrumentation.recent_requests(g.user.organization_id)
+    return render_template('debug-requests.html', recent=recent)
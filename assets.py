@@ -0,0 +1,122 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+from threading import Lock
+from flask import abort, current_app, request, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+BROTLI_QUALITY = 5
+HASH_LENGTH = 12
+COMPRESSIBLE_TYPES = {'text/css', 'text/javascript', 'application/javascript', 'application/json', 'image/svg+xml', 'text/plain'}
+DYNAMIC_TYPES = {'text/html', 'application/json'}
+
+def compress(data, encoding, level=COMPRESS_LEVEL):
+    '''returns data compressed with gzip or brotli'''
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY if level < 9 else 11)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+def supported_encodings():
+    '''returns the content encodings this process can produce, best first'''
+    return ['br', 'gzip'] if brotli else ['gzip']
+
+def choose_encoding(available):
+    '''returns the best of the available encodings the client accepts, or None'''
+    for encoding in supported_encodings():
+        if encoding in available and request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+class Asset:
+    '''a static file with its content hash and the precompressed variants worth serving'''
+
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        self.digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        root, ext = os.path.splitext(filename)
+        self.hashed_name = f'{root}.{self.digest}{ext}'
+        self.variants = {None: data}
+        if self.mimetype in COMPRESSIBLE_TYPES:
+            for encoding in supported_encodings():
+                compressed = compress(data, encoding, level=9)
+                if len(compressed) < len(data):
+                    self.variants[encoding] = compressed
+
+class AssetPipeline:
+    '''serves static files under content-hashed names with far-future caching and compresses large dynamic responses'''
+
+    def __init__(self):
+        self.lock = Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('ASSET_MAX_AGE', ASSET_MAX_AGE)
+        app.config.setdefault('COMPRESS_MIN_SIZE', COMPRESS_MIN_SIZE)
+        app.config.setdefault('COMPRESS_LEVEL', COMPRESS_LEVEL)
+        app.extensions['assets'] = None
+        app.add_url_rule('/assets/<path:filename>', 'asset', self.serve)
+        app.add_template_global(self.asset_url, 'asset_url')
+        app.after_request(self.compress_response)
+
+    def manifest(self):
+        '''returns {filename: Asset} and {hashed name: Asset} for the static folder, reading and compressing it once per process'''
+        app = current_app._get_current_object()
+        if app.extensions['assets'] is None:
+            with self.lock:
+                if app.extensions['assets'] is None:
+                    by_name = {}
+                    for root, dirs, files in os.walk(app.static_folder):
+                        for name in files:
+                            path = os.path.join(root, name)
+                            filename = os.path.relpath(path, app.static_folder).replace(os.sep, '/')
+                            with open(path, 'rb') as file:
+                                by_name[filename] = Asset(filename, file.read())
+                    app.extensions['assets'] = (by_name, {asset.hashed_name: asset for asset in by_name.values()})
+        return app.extensions['assets']
+
+    def asset_url(self, filename):
+        '''returns the fingerprinted url of a static file, or its plain static url in debug mode or if it is missing'''
+        if not current_app.debug:
+            asset = self.manifest()[0].get(filename)
+            if asset:
+                return url_for('asset', filename=asset.hashed_name)
+        return url_for('static', filename=filename)
+
+    def serve(self, filename):
+        '''serves a fingerprinted asset, precompressed when the client accepts it, as immutable for ASSET_MAX_AGE'''
+        asset = self.manifest()[1].get(filename)
+        if asset is None:
+            abort(404)
+        encoding = choose_encoding(asset.variants)
+        response = current_app.response_class(asset.variants[encoding], mimetype=asset.mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.set_etag(f'{asset.digest}-{encoding or "identity"}')
+        response.headers['Cache-Control'] = f"public, max-age={current_app.config['ASSET_MAX_AGE']}, immutable"
+        return response.make_conditional(request)
+
+    def compress_response(self, response):
+        '''compresses HTML and JSON responses of at least COMPRESS_MIN_SIZE bytes for clients that accept it'''
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers or response.mimetype not in DYNAMIC_TYPES):
+            return response
+        response.vary.add('Accept-Encoding')
+        data = response.get_data()
+        if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+            return response
+        encoding = choose_encoding(supported_encodings())
+        if encoding:
+            response.set_data(compress(data, encoding, current_app.config['COMPRESS_LEVEL']))
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+asset_pipeline = AssetPipeline()
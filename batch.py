@@ -0,0 +1,182 @@
+from sqlalchemy import select, func, and_
+from models import db, Profile, Role, RoleFunction, Company, Map, CompanyMap, FunctionMap
+from reference import reference_data
+
+MAX_BATCH = 100
+
+PROFILE_FIELDS = ['first_name', 'last_name', 'headline', 'linkedin_url', 'city', 'state', 'country',
+                  'company', 'level', 'functions', 'start_date']
+COMPANY_FIELDS = ['name', 'domain', 'employees']
+MAP_FIELDS = ['name', 'level', 'functions', 'companies']
+ROLE_FIELDS = {'company', 'level', 'functions', 'start_date'}
+
+class BatchError(ValueError):
+    '''raised when a batch request names unknown fields, malformed ids or too many ids'''
+
+def parse_ids(value):
+    '''returns the distinct ids of a comma separated string or a list of integers in request order; raises BatchError if any is not an integer'''
+    if value is None or value == '':
+        return []
+    values = value.split(',') if isinstance(value, str) else value
+    if not isinstance(values, list):
+        raise BatchError('ids must be a list of integers')
+    if len(values) > MAX_BATCH:
+        raise BatchError(f'At most {MAX_BATCH} ids can be requested at once')
+    ids, seen = [], set()
+    for id in values:
+        if isinstance(value, str):
+            try:
+                id = int(id)
+            except ValueError:
+                raise BatchError(f'Invalid id: {id}')
+        elif not isinstance(id, int) or isinstance(id, bool):
+            raise BatchError(f'Invalid id: {id!r}')
+        if id not in seen:
+            seen.add(id)
+            ids.append(id)
+    return ids
+
+def parse_fields(value, allowed):
+    '''returns the requested fields of a comma separated string or list, or every allowed field if none are given'''
+    if value is None or value == '':
+        return list(allowed)
+    fields = value.split(',') if isinstance(value, str) else value
+    if not isinstance(fields, list):
+        raise BatchError('fields must be a list of names')
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise BatchError(f"Unknown fields: {', '.join(map(str, unknown))}")
+    return [field for field in allowed if field in fields]
+
+def batch_result(ids, rows):
+    '''returns {'items': [...], 'not_found': [...]} with items in the order their ids were requested'''
+    return {
+        'items': [rows[id] for id in ids if id in rows],
+        'not_found': [id for id in ids if id not in rows]
+    }
+
+def load_profiles(organization_id, ids, fields):
+    '''returns an organization's profiles by id with their primary role in at most two queries'''
+    if not ids:
+        return batch_result(ids, {})
+    with_role = bool(ROLE_FIELDS.intersection(fields))
+    columns = [Profile.id, Profile.first_name, Profile.last_name, Profile.headline, Profile.linkedin_url,
+               Profile.city, Profile.state_id, Profile.country_id]
+    statement = select(*columns).where(Profile.organization_id == organization_id, Profile.id.in_(ids))
+    if with_role:
+        statement = statement.add_columns(Role.id.label('role_id'), Role.level_id, Role.start_date, Company.name.label('company_name')).outerjoin(
+            Role, and_(Role.profile_id == Profile.id, Role.is_primary == True)
+        ).outerjoin(Company, Company.id == Role.company_id)
+    rows = db.session.execute(statement).all()
+
+    functions = {}
+    role_ids = [row.role_id for row in rows if row.role_id] if with_role else []
+    if 'functions' in fields and role_ids:
+        for role_id, function_id in db.session.execute(
+            select(RoleFunction.role_id, RoleFunction.function_id).where(RoleFunction.role_id.in_(role_ids)).order_by(RoleFunction.function_id)
+        ):
+            functions.setdefault(role_id, []).append(reference_data.function(function_id).name)
+
+    profiles = {}
+    for row in rows:
+        state = reference_data.state(row.state_id) if row.state_id else None
+        country = reference_data.country(row.country_id) if row.country_id else None
+        values = {
+            'first_name': row.first_name,
+            'last_name': row.last_name,
+            'headline': row.headline,
+            'linkedin_url': row.linkedin_url,
+            'city': row.city,
+            'state': state.name if state else None,
+            'country': country.name if country else None
+        }
+        if with_role:
+            level = reference_data.level(row.level_id) if row.level_id else None
+            values.update({
+                'company': row.company_name,
+                'level': level.name if level else None,
+                'functions': functions.get(row.role_id, []),
+                'start_date': row.start_date.isoformat() if row.start_date else None
+            })
+        profiles[row.id] = {'id': row.id, **{field: values[field] for field in fields}}
+    return batch_result(ids, profiles)
+
+def load_companies(organization_id, ids, fields):
+    '''returns an organization's companies by id, with their current employee counts if asked for, in one query'''
+    if not ids:
+        return batch_result(ids, {})
+    statement = select(Company.id, Company.name, Company.domain).where(
+        Company.organization_id == organization_id, Company.id.in_(ids)
+    )
+    if 'employees' in fields:
+        employees = select(Role.company_id, func.count().label('employees')).where(
+            Role.company_id.in_(ids), Role.is_primary == True, Role.end_date == None
+        ).group_by(Role.company_id).subquery()
+        statement = statement.add_columns(func.coalesce(employees.c.employees, 0).label('employees')).outerjoin(
+            employees, employees.c.company_id == Company.id
+        )
+    companies = {}
+    for row in db.session.execute(statement):
+        values = row._asdict()
+        companies[row.id] = {'id': row.id, **{field: values[field] for field in fields}}
+    return batch_result(ids, companies)
+
+def load_maps(organization_id, ids, fields):
+    '''returns an organization's maps by id with their function names and company ids in at most three queries'''
+    if not ids:
+        return batch_result(ids, {})
+    rows = db.session.execute(
+        select(Map.id, Map.name, Map.level_id).where(Map.organization_id == organization_id, Map.id.in_(ids))
+    ).all()
+    map_ids = [row.id for row in rows]
+
+    functions, companies = {}, {}
+    if 'functions' in fields and map_ids:
+        for map_id, function_id in db.session.execute(
+            select(FunctionMap.map_id, FunctionMap.function_id).where(FunctionMap.map_id.in_(map_ids)).order_by(FunctionMap.function_id)
+        ):
+            functions.setdefault(map_id, []).append(reference_data.function(function_id).name)
+    if 'companies' in fields and map_ids:
+        for map_id, company_id in db.session.execute(
+            select(CompanyMap.map_id, CompanyMap.company_id).where(CompanyMap.map_id.in_(map_ids)).order_by(CompanyMap.company_id)
+        ):
+            companies.setdefault(map_id, []).append(company_id)
+
+    maps = {}
+    for row in rows:
+        level = reference_data.level(row.level_id) if row.level_id else None
+        values = {
+            'name': row.name,
+            'level': level.name if level else None,
+            'functions': functions.get(row.id, []),
+            'companies': companies.get(row.id, [])
+        }
+        maps[row.id] = {'id': row.id, **{field: values[field] for field in fields}}
+    return batch_result(ids, maps)
+
+LOADERS = {
+    'profiles': (load_profiles, PROFILE_FIELDS),
+    'companies': (load_companies, COMPANY_FIELDS),
+    'maps': (load_maps, MAP_FIELDS)
+}
+
+def load_batch(organization_id, kind, ids, fields=None):
+    '''parses ids and sparse fields for one kind of entity and loads them scoped to the organization'''
+    if kind not in LOADERS:
+        raise BatchError(f'Unknown type: {kind}')
+    loader, allowed = LOADERS[kind]
+    return loader(organization_id, parse_ids(ids), parse_fields(fields, allowed))
+
+def run_batch(organization_id, request):
+    '''loads every kind named in a batch request of {kind: {'ids': [...], 'fields': [...]}} with a fixed number of queries per kind'''
+    if not isinstance(request, dict) or not request:
+        raise BatchError('A batch must name at least one of: ' + ', '.join(LOADERS))
+    unknown = [kind for kind in request if kind not in LOADERS]
+    if unknown:
+        raise BatchError(f"Unknown types: {', '.join(map(str, unknown))}")
+    results = {}
+    for kind, spec in request.items():
+        if not isinstance(spec, dict):
+            raise BatchError(f'{kind} must be an object with ids and optional fields')
+        results[kind] = load_batch(organization_id, kind, spec.get('ids'), spec.get('fields'))
+    return results
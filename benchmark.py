@@ -0,0 +1,102 @@
+import json
+import math
+import time
+from datetime import datetime
+from models import db, User, Company, Profile, Map
+from identity import CURR_USER_KEY, take_snapshot
+
+ITERATIONS = 20
+WARMUP = 2
+
+def percentile(values, percent):
+    '''returns the nearest-rank percentile of a list of numbers'''
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+def benchmark_routes(organization_id):
+    '''returns (name, url) pairs for the main read routes of an organization'''
+    company = Company.query.filter_by(organization_id=organization_id).order_by(Company.id).first()
+    profile = Profile.query.filter_by(organization_id=organization_id).order_by(Profile.id).first()
+    map = Map.query.filter_by(organization_id=organization_id).order_by(Map.id).first()
+    routes = [
+        ('org_home', f'/organizations/{organization_id}'),
+        ('list_profiles', '/profiles'),
+        ('api_profiles', '/api/profiles?per_page=100'),
+        ('list_companies', '/companies'),
+        ('api_companies', '/api/companies?per_page=100'),
+        ('maps', '/maps'),
+    ]
+    if company:
+        routes.append(('company_detail', f'/companies/{company.id}'))
+        routes.append(('company_search', f'/api/companies/search?q={company.name.split()[0][:3].lower()}'))
+    if profile:
+        routes.append(('profile_detail', f'/profiles/{profile.id}'))
+    if map:
+        routes.append(('map_detail', f'/maps/{map.id}'))
+    return routes
+
+def run_benchmark(app, organization_id, iterations=ITERATIONS, warmup=WARMUP):
+    '''drives the test client against each route as the organization's admin and returns latency percentiles and query counts'''
+    with app.app_context():
+        user = User.query.filter_by(organization_id=organization_id, is_admin=True).first()
+        if not user:
+            raise ValueError(f'Organization #{organization_id} has no admin user')
+        snapshot = take_snapshot(user)
+        routes = benchmark_routes(organization_id)
+        db.session.remove()
+
+    results = {}
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = snapshot
+    # query counts are read from the response headers, which production configs leave off
+    timing_headers = app.config['SQL_TIMING_HEADERS']
+    app.config['SQL_TIMING_HEADERS'] = True
+    try:
+        for name, url in routes:
+            for _ in range(warmup):
+                client.get(url)
+            timings, queries = [], []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - start) * 1000)
+                queries.append(int(response.headers.get('X-Query-Count', 0)))
+            results[name] = {
+                'url': url,
+                'status': response.status_code,
+                'p50_ms': round(percentile(timings, 50), 2),
+                'p90_ms': round(percentile(timings, 90), 2),
+                'p99_ms': round(percentile(timings, 99), 2),
+                'mean_ms': round(sum(timings) / len(timings), 2),
+                'queries': max(queries)
+            }
+    finally:
+        app.config['SQL_TIMING_HEADERS'] = timing_headers
+    return {
+        'created_at': datetime.utcnow().isoformat(),
+        'organization_id': organization_id,
+        'iterations': iterations,
+        'routes': results
+    }
+
+def save_results(results, path):
+    '''writes benchmark results as JSON'''
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+def load_results(path):
+    '''reads benchmark results written by save_results'''
+    with open(path) as f:
+        return json.load(f)
+
+def compare_results(baseline, current):
+    '''returns (route, baseline p50, current p50, percent change, baseline queries, current queries) for routes in both runs'''
+    rows = []
+    for name, result in current['routes'].items():
+        before = baseline['routes'].get(name)
+        if not before:
+            continue
+        change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0
+        rows.append((name, before['p50_ms'], result['p50_ms'], round(change, 1), before['queries'], result['queries']))
+    return rows
@@ -0,0 +1,85 @@
+from sqlalchemy import select, func, case, distinct, tuple_, literal, union_all
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from models import db, Profile, Role, RoleFunction
+from reference import reference_data
+from pagination import KeysetPage, encode_cursor, decode_cursor, cursor_values, DEFAULT_PER_PAGE, MAX_PER_PAGE
+
+SECTIONS = ['employees', 'alumni']
+MEMBER_KEY = [Profile.last_name, Profile.first_name, Role.id]
+
+class CompanyMember:
+    '''a profile's role at a company with its level and function names'''
+
+    def __init__(self, row):
+        self.id = row.profile_id
+        self.first_name = row.first_name
+        self.last_name = row.last_name
+        self.headline = row.headline
+        self.start_date = row.start_date
+        self.end_date = row.end_date
+        level = reference_data.level(row.level_id)
+        self.level = level.name if level else None
+        self.functions = [reference_data.function(id).name for id in row.function_ids or [] if reference_data.function(id)]
+
+def section_filter(name):
+    '''returns the condition selecting a section's roles'''
+    return Role.end_date == None if name == 'employees' else Role.end_date != None
+
+def section_totals(company_id):
+    '''returns one grouped statement counting the distinct people in each section of the company'''
+    section = case((Role.end_date == None, 'employees'), else_='alumni')
+    return select(section.label('section'), func.count(distinct(Role.profile_id)).label('total')).where(
+        Role.company_id == company_id, Role.profile_id != None
+    ).group_by(section)
+
+def member_rows(company_id, cursors, per_page):
+    '''returns one statement selecting a page of each section, with function ids read only for the rows on the pages'''
+    pages = []
+    for name in SECTIONS:
+        page = select(
+            Profile.id.label('profile_id'),
+            Profile.first_name,
+            Profile.last_name,
+            Profile.headline,
+            Role.id.label('role_id'),
+            Role.level_id,
+            Role.start_date,
+            Role.end_date,
+            literal(name).label('section')
+        ).join(Role, Role.profile_id == Profile.id).where(Role.company_id == company_id, section_filter(name))
+        if cursors.get(name):
+            page = page.where(tuple_(*MEMBER_KEY) > tuple_(*cursors[name]))
+        pages.append(page.order_by(*MEMBER_KEY).limit(per_page + 1))
+    members = union_all(*pages).subquery()
+
+    function_ids = select(
+        func.array_agg(aggregate_order_by(RoleFunction.function_id, RoleFunction.function_id))
+    ).where(RoleFunction.role_id == members.c.role_id).scalar_subquery()
+    return select(members, function_ids.label('function_ids')).order_by(
+        members.c.section, members.c.last_name, members.c.first_name, members.c.role_id
+    )
+
+def load_company_members(company_id, args):
+    '''returns {section: KeysetPage of CompanyMembers with a total} for a company's current and former employees in two queries'''
+    per_page = max(1, min(args.get('per_page', DEFAULT_PER_PAGE, type=int), MAX_PER_PAGE))
+    cursors = {}
+    for name in SECTIONS:
+        values = cursor_values(decode_cursor(args.get(f'{name}_after')), MEMBER_KEY)
+        if values:
+            cursors[name] = values
+    rows = {name: [] for name in SECTIONS}
+    for row in db.session.execute(member_rows(company_id, cursors, per_page)):
+        rows[row.section].append(row)
+    totals = {name: 0 for name in SECTIONS}
+    totals.update(db.session.execute(section_totals(company_id)).tuples().all())
+
+    pages = {}
+    for name in SECTIONS:
+        section_rows = rows[name]
+        next_cursor = None
+        if len(section_rows) > per_page:
+            section_rows = section_rows[:per_page]
+            last = section_rows[-1]
+            next_cursor = encode_cursor([last.last_name, last.first_name, last.role_id])
+        pages[name] = KeysetPage([CompanyMember(row) for row in section_rows], next_cursor, None, per_page, totals[name])
+    return pages
@@ -0,0 +1,119 @@
+from bisect import bisect_left, insort
+from collections import OrderedDict, defaultdict
+from threading import Lock
+import heapq
+import time
+from models import db, Company
+
+MAX_ORGANIZATIONS = 50
+MAX_AGE = 300
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+def normalize(text):
+    '''lowercases text and strips the scheme and www. prefix from domains'''
+    text = (text or '').strip().lower()
+    for prefix in ('https://', 'http://', 'www.'):
+        if text.startswith(prefix):
+            text = text[len(prefix):]
+    return text.rstrip('/')
+
+def trigrams(text):
+    '''returns the set of 3-character substrings of text'''
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class CompanyIndex:
+    '''prefix and trigram index over one organization's company names and domains'''
+
+    def __init__(self, rows):
+        self.companies = {}
+        self.prefixes = []
+        self.words = []
+        self.grams = defaultdict(set)
+        self.built_at = time.monotonic()
+        for id, name, domain in rows:
+            self._insert(id, name, domain, list.append)
+        self.prefixes.sort()
+        self.words.sort()
+
+    def _insert(self, id, name, domain, add):
+        '''adds a company's name and domain keys to the prefix lists and its trigrams to the substring index'''
+        name_key = normalize(name)
+        domain_key = normalize(domain)
+        self.companies[id] = (name, domain, f'{name_key} {domain_key}')
+        add(self.prefixes, (name_key, id))
+        add(self.prefixes, (domain_key, id))
+        for word in name_key.split()[1:]:
+            add(self.words, (word, id))
+        for gram in trigrams(self.companies[id][2]):
+            self.grams[gram].add(id)
+
+    def add(self, company):
+        '''adds a newly created company to the index'''
+        if company.id not in self.companies:
+            self._insert(company.id, company.name, company.domain, insort)
+
+    def search(self, term, limit=DEFAULT_LIMIT):
+        '''returns up to limit (name, domain) pairs: name/domain prefix matches first, then word prefixes, then substrings'''
+        term = normalize(term)
+        if not term:
+            return []
+        found = []
+        for keys in (self.prefixes, self.words):
+            i = bisect_left(keys, (term,))
+            while len(found) < limit and i < len(keys) and keys[i][0].startswith(term):
+                if keys[i][1] not in found:
+                    found.append(keys[i][1])
+                i += 1
+        if len(found) < limit and len(term) >= 3:
+            candidates = set.intersection(*(self.grams.get(gram, set()) for gram in trigrams(term)))
+            matches = (id for id in candidates if id not in found and term in self.companies[id][2])
+            found.extend(heapq.nsmallest(limit - len(found), matches))
+        return [self.companies[id][:2] for id in found]
+
+class CompanyIndexCache:
+    '''lazily built company indexes for the most recently searched organizations'''
+
+    def __init__(self, max_organizations=MAX_ORGANIZATIONS, max_age=MAX_AGE):
+        self.max_organizations = max_organizations
+        self.max_age = max_age
+        self.indexes = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, organization_id):
+        '''returns the organization's index, building it from the database when missing or stale'''
+        with self.lock:
+            index = self.indexes.get(organization_id)
+            if index and time.monotonic() - index.built_at < self.max_age:
+                self.indexes.move_to_end(organization_id)
+                return index
+        rows = db.session.query(Company.id, Company.name, Company.domain).filter(
+            Company.organization_id == organization_id
+        ).all()
+        index = CompanyIndex(rows)
+        with self.lock:
+            self.indexes[organization_id] = index
+            self.indexes.move_to_end(organization_id)
+            while len(self.indexes) > self.max_organizations:
+                self.indexes.popitem(last=False)
+        return index
+
+    def add(self, company):
+        '''adds a company to its organization's index if that index is loaded'''
+        with self.lock:
+            index = self.indexes.get(company.organization_id)
+            if index:
+                index.add(company)
+
+    def search(self, organization_id, term, limit=DEFAULT_LIMIT):
+        '''returns ranked (name, domain) matches for term within an organization'''
+        index = self.get(organization_id)
+        with self.lock:
+            return index.search(term, limit)
+
+    def clear(self):
+        '''drops every loaded index'''
+        with self.lock:
+            self.indexes.clear()
+
+company_index = CompanyIndexCache()
@@ -0,0 +1,103 @@
+from threading import Lock
+import time
+from sqlalchemy import func, select
+from models import db, Profile, Company, Role, Level, Function, RoleFunction, Map, CompanyMap, FunctionMap, MapCell
+
+DASHBOARD_TTL = 60
+RECENT_COUNT = 5
+
+class TTLCache:
+    '''thread-safe mapping whose entries expire after ttl seconds'''
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = Lock()
+
+    def get(self, key):
+        '''returns the cached value for key or None if it is missing or expired'''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            self.entries.pop(key, None)
+            return None
+
+    def set(self, key, value):
+        '''stores value under key for ttl seconds'''
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key):
+        '''drops the entry for key'''
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        '''drops every entry'''
+        with self.lock:
+            self.entries.clear()
+
+dashboard_cache = TTLCache(DASHBOARD_TTL)
+
+def build_dashboard(org_id):
+    '''computes an organization's dashboard from aggregate queries, returning plain rows safe to cache across requests'''
+
+    totals = db.session.query(
+        select(func.count(Profile.id)).where(Profile.organization_id == org_id).scalar_subquery(),
+        select(func.count(Company.id)).where(Company.organization_id == org_id).scalar_subquery()
+    ).one()
+
+    current_roles = db.session.query(Role).join(Profile, Profile.id == Role.profile_id).filter(
+        Profile.organization_id == org_id,
+        Role.is_primary == True,
+        Role.end_date == None
+    ).subquery()
+    level_counts = db.session.query(Level.name, func.count(current_roles.c.id)).join(
+        current_roles, current_roles.c.level_id == Level.id
+    ).group_by(Level.id, Level.name).order_by(Level.id).all()
+    function_counts = db.session.query(Function.name, func.count(current_roles.c.id)).join(
+        RoleFunction, RoleFunction.function_id == Function.id
+    ).join(
+        current_roles, current_roles.c.id == RoleFunction.role_id
+    ).group_by(Function.id, Function.name).order_by(Function.id).all()
+
+    recent_profiles = db.session.query(Profile.id, Profile.first_name, Profile.last_name, Profile.headline).filter(
+        Profile.organization_id == org_id
+    ).order_by(Profile.id.desc()).limit(RECENT_COUNT).all()
+    recent_companies = db.session.query(Company.id, Company.name, Company.domain).filter(
+        Company.organization_id == org_id
+    ).order_by(Company.id.desc()).limit(RECENT_COUNT).all()
+
+    company_count = select(func.count()).where(CompanyMap.map_id == Map.id).scalar_subquery()
+    function_count = select(func.count()).where(FunctionMap.map_id == Map.id).scalar_subquery()
+    filled_count = select(func.count()).where(MapCell.map_id == Map.id).scalar_subquery()
+    maps = db.session.query(Map.id, Map.name, company_count * function_count, filled_count).filter(
+        Map.organization_id == org_id
+    ).order_by(Map.name).all()
+    coverage = [
+        {'id': id, 'name': name, 'filled': filled, 'cells': cells, 'percent': round(100 * filled / cells) if cells else 0}
+        for id, name, cells, filled in maps
+    ]
+
+    return {
+        'profile_count': totals[0],
+        'company_count': totals[1],
+        'level_counts': level_counts,
+        'function_counts': function_counts,
+        'recent_profiles': recent_profiles,
+        'recent_companies': recent_companies,
+        'map_coverage': coverage
+    }
+
+def get_dashboard(org_id):
+    '''returns the organization's dashboard, recomputing it when the cached copy is missing or expired'''
+    dashboard = dashboard_cache.get(org_id)
+    if dashboard is None:
+        dashboard = build_dashboard(org_id)
+        dashboard_cache.set(org_id, dashboard)
+    return dashboard
+
+def invalidate_dashboard(org_id):
+    '''drops the organization's cached dashboard after a write'''
+    dashboard_cache.invalidate(org_id)
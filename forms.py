@@ -1,6 +1,8 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, PasswordField, DateField, BooleanField, SelectField, SelectMultipleField
 from wtforms.validators import InputRequired, Optional, URL, Email, DataRequired, Length, EqualTo, ValidationError
+from reference import reference_data
 
 def validate_functions(form, field):
     if not field.data or len(field.data) == 0:
@@ -57,94 +59,36 @@ class ProfileForm(FlaskForm):
 
     #role fields
 
-    function_choices = [('Executive', 'Executive'), 
-                    ('Finance', 'Finance'), 
-                    ('Operations', 'Operations'), 
-                    ('Engineering', 'Engineering'), 
-                    ('Product','Product'), 
-                    ('Sales', 'Sales'), 
-                    ('Security', 'Security'), 
-                    ('Marketing', 'Marketing'), 
-                    ('Human Resources', 'Human Resources'), 
-                    ('Customer Services', 'Customer Services'),
-                    ('Founder', 'Founder')
-                    ]
-    level_choices = [('Chief', 'Chief'), 
-                ('President', 'President'), 
-                ('Executive Vice President', 'Executive Vice President'), 
-                ('Senior Vice President', 'Senior Vice President'),
-                ('Vice President', 'Vice President'),
-                ('Associate Vice President', 'Associate Vice President'),
-                ('Head', 'Head'),
-                ('Partner', 'Partner'),
-                ('Senior Director', 'Senior Director'),
-                ('Director', 'Director'),
-                ('Associate Director', 'Associate Director'),
-                ('Senior Manager', 'Senior Manager'),
-                ('Manager', 'Manager'),
-                ('Senior Associate', 'Senior Associate'),
-                ('Associate', 'Associate'),
-                ('Senior Analyst', 'Senior Analyst'),
-                ('Junior', 'Junior')
-                ]
-    us_state_codes = [
-    (None, "Select State (optional)"), ("AL", "Alabama"), ("AK", "Alaska"), ("AZ", "Arizona"), ("AR", "Arkansas"), ("CA", "California"),
-    ("CO", "Colorado"), ("CT", "Connecticut"), ("DE", "Delaware"), ("FL", "Florida"), ("GA", "Georgia"),
-    ("HI", "Hawaii"), ("ID", "Idaho"), ("IL", "Illinois"), ("IN", "Indiana"), ("IA", "Iowa"), ("KS", "Kansas"),
-    ("KY", "Kentucky"), ("LA", "Louisiana"), ("ME", "Maine"), ("MD", "Maryland"), ("MA", "Massachusetts"),
-    ("MI", "Michigan"), ("MN", "Minnesota"), ("MS", "Mississippi"), ("MO", "Missouri"), ("MT", "Montana"),
-    ("NE", "Nebraska"), ("NV", "Nevada"), ("NH", "New Hampshire"), ("NJ", "New Jersey"), ("NM", "New Mexico"),
-    ("NY", "New York"), ("NC", "North Carolina"), ("ND", "North Dakota"), ("OH", "Ohio"), ("OK", "Oklahoma"),
-    ("OR", "Oregon"), ("PA", "Pennsylvania"), ("RI", "Rhode Island"), ("SC", "South Carolina"), ("SD", "South Dakota"),
-    ("TN", "Tennessee"), ("TX", "Texas"), ("UT", "Utah"), ("VT", "Vermont"), ("VA", "Virginia"), ("WA", "Washington"),
-    ("WV", "West Virginia"), ("WI", "Wisconsin"), ("WY", "Wyoming")
-]
-    country_codes = [('', 'Select Country'), ('USA', 'United States'), ('GBR', 'United Kingdom')]
-    
-    level = SelectField('Primary Level', choices=level_choices, validators=[InputRequired()])
-    functions = SelectMultipleField('Primary Functions', choices=function_choices, validators=[validate_functions])
+    level = SelectField('Primary Level', validators=[InputRequired()])
+    functions = SelectMultipleField('Primary Functions', validators=[validate_functions])
     start_date = DateField('Primary Start Date', validators=[InputRequired()])
     company = StringField('Primary Company Domain', validators=[URL(), InputRequired()])
     city = StringField('City (optional)', validators=[Optional()])
-    state = SelectField('State', choices=us_state_codes, validators=[Optional()])
-    country = SelectField('Country', choices=country_codes, validators=[InputRequired()])
+    state = SelectField('State', validators=[Optional()])
+    country = SelectField('Country', validators=[InputRequired()])
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.level.choices = reference_data.level_choices()
+        self.functions.choices = reference_data.function_choices()
+        self.state.choices = reference_data.state_choices()
+        self.country.choices = reference_data.country_choices()
+
+class ProfileImportForm(FlaskForm):
+    '''defines fields to upload a CSV or JSONL file of profiles'''
+
+    file = FileField('Profiles File (.csv or .jsonl)', validators=[FileRequired(), FileAllowed(['csv', 'jsonl'], 'CSV or JSONL files only')])
 
 class MapForm(FlaskForm):
     '''defines fields to create or edit a contact map'''
 #name, level, functions, companies
-    
-    level_choices = [('Chief', 'Chief'), 
-            ('President', 'President'), 
-            ('Executive Vice President', 'Executive Vice President'), 
-            ('Senior Vice President', 'Senior Vice President'),
-            ('Vice President', 'Vice President'),
-            ('Associate Vice President', 'Associate Vice President'),
-            ('Head', 'Head'),
-            ('Partner', 'Partner'),
-            ('Senior Director', 'Senior Director'),
-            ('Director', 'Director'),
-            ('Associate Director', 'Associate Director'),
-            ('Senior Manager', 'Senior Manager'),
-            ('Manager', 'Manager'),
-            ('Senior Associate', 'Senior Associate'),
-            ('Associate', 'Associate'),
-            ('Senior Analyst', 'Senior Analyst'),
-            ('Junior', 'Junior')
-            ]
-    function_choices = [('Executive', 'Executive'), 
-                ('Finance', 'Finance'), 
-                ('Operations', 'Operations'), 
-                ('Engineering', 'Engineering'), 
-                ('Product','Product'), 
-                ('Sales', 'Sales'), 
-                ('Security', 'Security'), 
-                ('Marketing', 'Marketing'), 
-                ('Human Resources', 'Human Resources'), 
-                ('Customer Services', 'Customer Services'),
-                ('Founder', 'Founder')
-                ]
 
     name = StringField('Contact Map Name', validators=[InputRequired()])
-    level = SelectField('Level', choices=level_choices, validators=[InputRequired()])
-    functions = SelectMultipleField('Functions', choices=function_choices, validators=[validate_functions])
-    companies = StringField('Companies', validators=[InputRequired()])
\ No newline at end of file
+    level = SelectField('Level', validators=[InputRequired()])
+    functions = SelectMultipleField('Functions', validators=[validate_functions])
+    companies = StringField('Companies', validators=[InputRequired()])
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.level.choices = reference_data.level_choices()
+        self.functions.choices = reference_data.function_choices()
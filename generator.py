@@ -0,0 +1,127 @@
+import random
+from datetime import date, timedelta
+from sqlalchemy import insert
+from models import db, User, Organization, Company, Profile, Role, RoleFunction, Map, FunctionMap, CompanyMap, ProfileSearch, CompanyTransition
+from passwords import password_hasher
+from reference import reference_data
+
+FIRST_NAMES = ['Ava', 'Ben', 'Cara', 'Dev', 'Eli', 'Fay', 'Gus', 'Hana', 'Ian', 'Jo', 'Kai', 'Lena', 'Max', 'Nia', 'Omar', 'Pia',
+               'Quinn', 'Rosa', 'Sam', 'Tara', 'Uma', 'Vic', 'Wes', 'Xena', 'Yuri', 'Zoe']
+LAST_NAMES = ['Adams', 'Baker', 'Chen', 'Diaz', 'Evans', 'Fischer', 'Garcia', 'Hughes', 'Ito', 'Jones', 'Khan', 'Lopez', 'Moore',
+              'Nguyen', 'Okafor', 'Patel', 'Quist', 'Reyes', 'Smith', 'Torres', 'Usman', 'Vargas', 'Wong', 'Young', 'Zhang']
+COMPANY_WORDS = ['Acme', 'Apex', 'Blue', 'Bright', 'Cloud', 'Core', 'Data', 'Delta', 'Echo', 'Fusion', 'Global', 'Green',
+                 'Iron', 'Lumen', 'Nova', 'Orbit', 'Peak', 'Prime', 'Quantum', 'Silver', 'Summit', 'Vertex']
+COMPANY_SUFFIXES = ['Labs', 'Systems', 'Partners', 'Health', 'Capital', 'Software', 'Energy', 'Foods', 'Inc', 'Group']
+STATES = ['CA', 'NY', 'TX', 'WA', 'MA', 'IL', 'CO', 'GA']
+CITIES = ['Austin', 'Boston', 'Chicago', 'Denver', 'Seattle', 'Atlanta', 'New York', 'San Francisco']
+PASSWORD = 'password'
+
+class GeneratedOrganization:
+    '''ids of a generated organization and the login of its admin user'''
+
+    def __init__(self, organization_id, email, company_ids, profile_ids, map_ids):
+        self.organization_id = organization_id
+        self.email = email
+        self.company_ids = company_ids
+        self.profile_ids = profile_ids
+        self.map_ids = map_ids
+
+def company_values(rng, organization_id, count):
+    '''returns insert values for count companies with distinct domains'''
+    companies = []
+    for i in range(count):
+        name = f'{rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_SUFFIXES)}'
+        companies.append({
+            'name': f'{name} {i}'[:30],
+            'domain': f"https://www.{name.lower().replace(' ', '')}{i}.com/",
+            'organization_id': organization_id
+        })
+    return companies
+
+def role_history(rng, organization_id, profile_id, company_ids, level_ids, max_roles):
+    '''returns a chronological list of roles for a profile, ending in one current primary role'''
+    count = rng.randint(1, max_roles)
+    start = date(2000, 1, 1) + timedelta(days=rng.randint(0, 3650))
+    roles = []
+    for i in range(count):
+        end = start + timedelta(days=rng.randint(180, 1800)) if i < count - 1 else None
+        roles.append({
+            'profile_id': profile_id,
+            'organization_id': organization_id,
+            'company_id': rng.choice(company_ids),
+            'level_id': level_ids[max(0, len(level_ids) - 1 - i * 2 - rng.randint(0, 4))],
+            'start_date': start,
+            'end_date': end,
+            'is_primary': end is None
+        })
+        if end:
+            start = end + timedelta(days=rng.randint(0, 90))
+    return roles
+
+def generate_organization(name, companies=200, profiles=2000, max_roles=4, maps=10, map_companies=25, seed=None, batch_size=1000):
+    '''creates an organization with an admin user and realistic companies, multi-role profiles and maps using seed.py's reference data'''
+    rng = random.Random(seed)
+    reference_data.load()
+    level_ids = sorted(reference_data.levels)
+    function_ids = sorted(reference_data.functions)
+
+    organization_id = db.session.execute(
+        insert(Organization).returning(Organization.id), {'name': name}
+    ).scalar_one()
+    email = f"admin@{name.lower().replace(' ', '-')}.test"
+    db.session.add(User.registerAdmin(email, PASSWORD, organization_id))
+
+    company_ids = db.session.execute(
+        insert(Company).returning(Company.id, sort_by_parameter_order=True),
+        company_values(rng, organization_id, companies)
+    ).scalars().all()
+
+    profile_ids = []
+    for offset in range(0, profiles, batch_size):
+        batch = []
+        for i in range(offset, min(profiles, offset + batch_size)):
+            first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            batch.append({
+                'first_name': first_name,
+                'last_name': last_name,
+                'headline': f'{rng.choice(["Leader", "Builder", "Operator", "Advisor"])} at {rng.choice(COMPANY_WORDS)}',
+                'linkedin_url': f'https://www.linkedin.com/in/{first_name.lower()}-{last_name.lower()}-{organization_id}-{i}',
+                'city': rng.choice(CITIES),
+                'state_id': rng.choice(STATES),
+                'country_id': 'USA',
+                'organization_id': organization_id
+            })
+        ids = db.session.execute(
+            insert(Profile).returning(Profile.id, sort_by_parameter_order=True), batch
+        ).scalars().all()
+        roles = [role for profile_id in ids for role in role_history(rng, organization_id, profile_id, company_ids, level_ids, max_roles)]
+        role_ids = db.session.execute(
+            insert(Role).returning(Role.id, sort_by_parameter_order=True), roles
+        ).scalars().all()
+        db.session.execute(insert(RoleFunction), [
+            {'role_id': role_id, 'function_id': function_id}
+            for role_id in role_ids
+            for function_id in rng.sample(function_ids, rng.randint(1, 3))
+        ])
+        ProfileSearch.refresh(ids)
+        CompanyTransition.add_profiles(ids)
+        profile_ids.extend(ids)
+
+    map_ids = []
+    for i in range(maps):
+        map = Map(name=f'Map {i}', level_id=rng.choice(level_ids), organization_id=organization_id)
+        db.session.add(map)
+        db.session.flush()
+        db.session.execute(insert(CompanyMap), [
+            {'map_id': map.id, 'company_id': company_id}
+            for company_id in rng.sample(company_ids, min(map_companies, len(company_ids)))
+        ])
+        db.session.execute(insert(FunctionMap), [
+            {'map_id': map.id, 'function_id': function_id}
+            for function_id in rng.sample(function_ids, rng.randint(2, 5))
+        ])
+        db.session.expire(map)
+        map.refresh_cells()
+        map_ids.append(map.id)
+    db.session.commit()
+    return GeneratedOrganization(organization_id, email, company_ids, profile_ids, map_ids)
@@ -0,0 +1,70 @@
+import hashlib
+import time
+from flask import session
+from models import db, User, Organization
+
+CURR_USER_KEY = "curr_user"
+IDENTITY_MAX_AGE = 300
+
+class CurrentUser:
+    '''the logged in user as described by the snapshot in their signed session'''
+
+    def __init__(self, snapshot):
+        self.email = snapshot['email']
+        self.organization_id = snapshot['organization_id']
+        self.is_admin = snapshot['is_admin']
+        self._organization = None
+
+    def __repr__(self):
+        return f"<CurrentUser {self.email}, organization #{self.organization_id}>"
+
+    @property
+    def organization(self):
+        '''loads the user's organization on first access'''
+        if self._organization is None:
+            self._organization = db.session.get(Organization, self.organization_id)
+        return self._organization
+
+def user_stamp(user):
+    '''returns a version stamp that changes whenever the user's password, organization or admin status changes'''
+    return hashlib.sha256(f'{user.password}|{user.organization_id}|{user.is_admin}'.encode()).hexdigest()[:16]
+
+def take_snapshot(user):
+    '''returns the compact session representation of a user'''
+    return {
+        'email': user.email,
+        'organization_id': user.organization_id,
+        'is_admin': user.is_admin,
+        'stamp': user_stamp(user),
+        'checked_at': int(time.time())
+    }
+
+def login_user(user):
+    '''stores the user's snapshot in the session'''
+    session[CURR_USER_KEY] = take_snapshot(user)
+
+def logout_user():
+    '''removes the user's snapshot from the session'''
+    session.pop(CURR_USER_KEY, None)
+
+def refresh_current_user():
+    '''revalidates the session against the database, logging out users whose stamp no longer matches'''
+    data = session.get(CURR_USER_KEY)
+    if not data:
+        return None
+    email = data if isinstance(data, str) else data.get('email')
+    user = db.session.get(User, email)
+    if not user or (isinstance(data, dict) and data.get('stamp') != user_stamp(user)):
+        logout_user()
+        return None
+    login_user(user)
+    return CurrentUser(session[CURR_USER_KEY])
+
+def load_current_user(max_age=IDENTITY_MAX_AGE):
+    '''returns the current user from the session snapshot, only querying the database when the snapshot is older than max_age'''
+    data = session.get(CURR_USER_KEY)
+    if not data:
+        return None
+    if isinstance(data, str) or time.time() - data.get('checked_at', 0) > max_age:
+        return refresh_current_user()
+    return CurrentUser(data)
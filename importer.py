@@ -0,0 +1,67 @@
+import csv
+import json
+from sqlalchemy.exc import IntegrityError
+from models import db
+from profiles import prepare_profiles, save_profiles
+from dashboard import invalidate_dashboard
+
+BATCH_SIZE = 500
+
+class ImportResult:
+    '''counts created profiles and collects (line, message) errors for rows that were skipped'''
+
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+
+def read_rows(stream, format):
+    '''yields (line number, row dict) from a CSV or JSONL text stream'''
+    if format == 'jsonl':
+        for line, text in enumerate(stream, 1):
+            if text.strip():
+                try:
+                    yield line, json.loads(text)
+                except ValueError:
+                    yield line, None
+    else:
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+
+def clean_row(row):
+    '''strips whitespace and turns scalar values into strings, leaving function lists as they are; None for non-object rows'''
+    if not isinstance(row, dict):
+        return None
+    return {
+        key: value if isinstance(value, list) or value is None else str(value).strip()
+        for key, value in row.items() if key
+    }
+
+def import_batch(batch, organization_id, result):
+    '''validates a batch with one lookup per table and saves its valid rows with a single flush and commit'''
+    built, errors = prepare_profiles(organization_id, [clean_row(row) for line, row in batch])
+    result.errors.extend((batch[index][0], str(e)) for index, e in errors)
+    if not built:
+        return
+    try:
+        save_profiles(built)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        result.errors.append((batch[0][0], f'Batch ending on line {batch[-1][0]} conflicted with a concurrent write and was not imported'))
+        return
+    result.created += len(built)
+
+def import_profiles(stream, organization_id, format='csv', batch_size=BATCH_SIZE):
+    '''streams profiles with their primary role from a CSV or JSONL file into an organization, committing once per batch'''
+    result = ImportResult()
+    batch = []
+    for line, row in read_rows(stream, format):
+        batch.append((line, row))
+        if len(batch) == batch_size:
+            import_batch(batch, organization_id, result)
+            batch = []
+    if batch:
+        import_batch(batch, organization_id, result)
+    invalidate_dashboard(organization_id)
+    return result
@@ -0,0 +1,145 @@
+from collections import deque
+from threading import Lock
+import time
+from flask import g, request, current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+RECENT_REQUESTS = 100
+SLOWEST_STATEMENTS = 3
+SLOW_REQUEST_MS = 500
+
+class RequestStats:
+    '''query count, database time and slowest statements of one request'''
+
+    def __init__(self, method, path, endpoint):
+        self.method = method
+        self.path = path
+        self.endpoint = endpoint
+        self.status = None
+        self.organization_id = None
+        self.query_count = 0
+        self.db_ms = 0.0
+        self.total_ms = None
+        self.slowest = []
+        self.started = time.perf_counter()
+        self.created_at = time.time()
+
+    def __repr__(self):
+        return f"<RequestStats {self.method} {self.path}: {self.query_count} queries, {self.db_ms:.1f}ms>"
+
+    def record(self, statement, elapsed_ms, keep):
+        '''adds one statement, keeping only the keep slowest'''
+        self.query_count += 1
+        self.db_ms += elapsed_ms
+        if len(self.slowest) < keep or elapsed_ms > self.slowest[-1][0]:
+            self.slowest.append((elapsed_ms, statement))
+            self.slowest.sort(key=lambda entry: entry[0], reverse=True)
+            del self.slowest[keep:]
+
+class QueryCounter:
+    '''counts the statements sent to the database by an engine, or by every engine, while it is active'''
+
+    def __init__(self, engine=Engine):
+        self.engine = engine
+        self.count = 0
+        self.statements = []
+
+    def _before_execute(self, conn, cursor, statement, *args):
+        self.count += 1
+        self.statements.append(statement)
+
+    def __enter__(self):
+        self.count = 0
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute', self._before_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._before_execute)
+
+class QueryBudgetExceeded(AssertionError):
+    '''raised when a block runs more statements than its query budget allows'''
+
+class query_budget(QueryCounter):
+    '''asserts the block runs at most max_queries statements, listing them when it does not'''
+
+    def __init__(self, max_queries, engine=Engine):
+        super().__init__(engine)
+        self.max_queries = max_queries
+
+    def __exit__(self, exc_type, *exc):
+        super().__exit__(exc_type, *exc)
+        if exc_type is None and self.count > self.max_queries:
+            statements = '\n'.join(f'  {statement}' for statement in self.statements)
+            raise QueryBudgetExceeded(f'{self.count} queries exceeded the budget of {self.max_queries}:\n{statements}')
+
+class SQLInstrumentation:
+    '''times every statement through engine events and reports per-request totals in logs, a recent requests buffer and, where enabled, headers'''
+
+    def __init__(self):
+        self.lock = Lock()
+        self.recent = deque(maxlen=RECENT_REQUESTS)
+        self.listening = False
+
+    def init_app(self, app):
+        app.config.setdefault('SQL_SLOWEST_STATEMENTS', SLOWEST_STATEMENTS)
+        app.config.setdefault('SQL_SLOW_REQUEST_MS', SLOW_REQUEST_MS)
+        app.config.setdefault('SQL_TIMING_HEADERS', None)
+        with self.lock:
+            if not self.listening:
+                event.listen(Engine, 'before_cursor_execute', self._before_execute)
+                event.listen(Engine, 'after_cursor_execute', self._after_execute)
+                self.listening = True
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._query_started = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not has_app_context():
+            return
+        stats = g.get('sql_stats')
+        started = getattr(context, '_query_started', None)
+        if stats is not None and started is not None:
+            stats.record(statement, (time.perf_counter() - started) * 1000, current_app.config['SQL_SLOWEST_STATEMENTS'])
+
+    def timing_headers(self):
+        '''returns whether responses report their query count and timing: SQL_TIMING_HEADERS if set, otherwise only in debug or testing'''
+        setting = current_app.config['SQL_TIMING_HEADERS']
+        if setting is None:
+            return current_app.debug or current_app.testing
+        return setting
+
+    def _start_request(self):
+        if request.endpoint != 'static':
+            g.sql_stats = RequestStats(request.method, request.full_path.rstrip('?'), request.endpoint)
+
+    def _finish_request(self, response):
+        stats = g.pop('sql_stats', None)
+        if stats is None:
+            return response
+        stats.status = response.status_code
+        stats.organization_id = getattr(g.get('user'), 'organization_id', None)
+        stats.total_ms = (time.perf_counter() - stats.started) * 1000
+        if self.timing_headers():
+            response.headers['X-Query-Count'] = str(stats.query_count)
+            response.headers['X-DB-Time'] = f'{stats.db_ms:.1f}'
+            response.headers['Server-Timing'] = f'db;dur={stats.db_ms:.1f}, app;dur={stats.total_ms:.1f}'
+        with self.lock:
+            self.recent.append(stats)
+        message = f'{stats.method} {stats.path} {stats.status}: {stats.query_count} queries, {stats.db_ms:.1f}ms db, {stats.total_ms:.1f}ms total'
+        if stats.total_ms > current_app.config['SQL_SLOW_REQUEST_MS']:
+            current_app.logger.warning(f'Slow request {message}')
+        else:
+            current_app.logger.info(message)
+        return response
+
+    def recent_requests(self, organization_id=None):
+        '''returns the recorded requests, newest first, optionally only those made by users of one organization'''
+        with self.lock:
+            return [stats for stats in reversed(self.recent)
+                    if organization_id is None or stats.organization_id == organization_id]
+
+sql_instrumentation = SQLInstrumentation()
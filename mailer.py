@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+import smtplib
+import time
+from flask import current_app
+from flask_mail import Mail, Message
+from models import db, OutboxEmail
+
+mail = Mail()
+
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 8
+RETRY_BACKOFF = timedelta(seconds=30)
+POLL_INTERVAL = 5
+
+def enqueue_email(subject, recipients, body):
+    '''adds an email to the outbox in the current transaction; the caller commits it along with its own changes'''
+    email = OutboxEmail(subject=subject, recipients=','.join(recipients), body=body)
+    db.session.add(email)
+    return email
+
+def mark_failed(email, error, now):
+    '''records a failed delivery and schedules the next attempt with exponential backoff'''
+    email.attempts += 1
+    email.last_error = str(error)[:500]
+    email.next_attempt_at = now + RETRY_BACKOFF * 2 ** (email.attempts - 1)
+
+def send_pending(batch_size=BATCH_SIZE):
+    '''delivers up to batch_size due emails over a single SMTP connection and returns how many were sent'''
+    now = datetime.now()
+    emails = OutboxEmail.query.filter(
+        OutboxEmail.sent_at == None,
+        OutboxEmail.attempts < MAX_ATTEMPTS,
+        OutboxEmail.next_attempt_at <= now
+    ).order_by(OutboxEmail.id).limit(batch_size).with_for_update(skip_locked=True).all()
+    if not emails:
+        db.session.commit()
+        return 0
+
+    sent = 0
+    refused = set()
+    try:
+        with mail.connect() as connection:
+            for email in emails:
+                try:
+                    connection.send(Message(
+                        email.subject,
+                        sender=current_app.config['MAIL_DEFAULT_SENDER'],
+                        recipients=email.recipients.split(','),
+                        body=email.body
+                    ))
+                except smtplib.SMTPRecipientsRefused as e:
+                    mark_failed(email, e, now)
+                    refused.add(email.id)
+                else:
+                    email.sent_at = datetime.now()
+                    sent += 1
+    except (smtplib.SMTPException, OSError) as e:
+        for email in emails:
+            if email.sent_at is None and email.id not in refused:
+                mark_failed(email, e, now)
+    db.session.commit()
+    return sent
+
+def run_worker(poll_interval=POLL_INTERVAL, once=False):
+    '''sends queued email until stopped, sleeping whenever the outbox has no full batch due'''
+    while True:
+        sent = send_pending()
+        if once:
+            return sent
+        if sent < BATCH_SIZE:
+            time.sleep(poll_interval)
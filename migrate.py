@@ -0,0 +1,35 @@
+import os
+from sqlalchemy import text
+from models import db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+def migration_files():
+    '''returns (version, path) for every SQL migration, ordered by version'''
+    return [(name[:-4], os.path.join(MIGRATIONS_DIR, name))
+            for name in sorted(os.listdir(MIGRATIONS_DIR)) if name.endswith('.sql')]
+
+def applied_migrations(connection):
+    '''returns the versions recorded in schema_migrations, creating the table on first use'''
+    connection.execute(text('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR(100) PRIMARY KEY,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )'''))
+    return {version for (version,) in connection.execute(text('SELECT version FROM schema_migrations'))}
+
+def run_migrations():
+    '''applies pending migrations in order, each in its own transaction, and returns the versions applied'''
+    with db.engine.begin() as connection:
+        applied = applied_migrations(connection)
+    ran = []
+    for version, path in migration_files():
+        if version in applied:
+            continue
+        with open(path) as f:
+            sql = f.read()
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql(sql)
+            connection.execute(text('INSERT INTO schema_migrations (version) VALUES (:version)'), {'version': version})
+        ran.append(version)
+    return ran
@@ -0,0 +1,16 @@
+-- indexes for the tenant, map and login access paths declared in models.py
+
+CREATE INDEX IF NOT EXISTS ix_profiles_organization_id ON profiles (organization_id, id);
+CREATE INDEX IF NOT EXISTS ix_profiles_organization_name ON profiles (organization_id, last_name, first_name, id);
+CREATE INDEX IF NOT EXISTS ix_companies_organization_id ON companies (organization_id, id);
+CREATE INDEX IF NOT EXISTS ix_companies_organization_name ON companies (organization_id, name, id);
+
+CREATE INDEX IF NOT EXISTS ix_roles_company_level_end ON roles (company_id, level_id, end_date);
+CREATE INDEX IF NOT EXISTS ix_roles_current_company_level ON roles (company_id, level_id) WHERE end_date IS NULL;
+CREATE INDEX IF NOT EXISTS ix_roles_profile_primary ON roles (profile_id, is_primary);
+CREATE INDEX IF NOT EXISTS ix_role_function_function_id ON role_function (function_id);
+
+CREATE INDEX IF NOT EXISTS ix_pending_users_expiration ON pending_users (expiration);
+CREATE INDEX IF NOT EXISTS ix_outbox_emails_due ON outbox_emails (next_attempt_at) WHERE sent_at IS NULL;
+
+ANALYZE profiles, companies, roles, role_function, pending_users, outbox_emails;
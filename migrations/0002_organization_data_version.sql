@@ -0,0 +1,3 @@
+-- per-organization version counter behind ETag/Last-Modified on read views
+ALTER TABLE organizations ADD COLUMN IF NOT EXISTS data_version BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE organizations ADD COLUMN IF NOT EXISTS data_updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
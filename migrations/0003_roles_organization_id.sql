@@ -0,0 +1,17 @@
+-- roles carry their organization so tenant tables can share the organization_id partition key
+
+ALTER TABLE roles ADD COLUMN IF NOT EXISTS organization_id INTEGER REFERENCES organizations (id) ON DELETE SET NULL;
+
+UPDATE roles SET organization_id = profiles.organization_id
+FROM profiles
+WHERE profiles.id = roles.profile_id AND roles.organization_id IS NULL;
+
+UPDATE roles SET organization_id = companies.organization_id
+FROM companies
+WHERE companies.id = roles.company_id AND roles.organization_id IS NULL;
+
+-- roles left without a profile or company belong to no organization and cannot be shown anywhere
+DELETE FROM role_function WHERE role_id IN (SELECT id FROM roles WHERE organization_id IS NULL);
+DELETE FROM roles WHERE organization_id IS NULL;
+
+ALTER TABLE roles ALTER COLUMN organization_id SET NOT NULL;
@@ -1,15 +1,15 @@
 from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
-from sqlalchemy import and_, UniqueConstraint
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from sqlalchemy import or_, and_, func, select, tuple_, UniqueConstraint
+from sqlalchemy.dialects.postgresql import ARRAY, TSVECTOR, insert as pg_insert
+from sqlalchemy.orm import selectinload, joinedload
+from datetime import datetime
+from passwords import password_hasher
+from routing import RoutingSession
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 def connect_db(app):
-    '''connects to database'''
-    db.app=app
+    '''connects to database; tables are created by the init-db command rather than on startup'''
     db.init_app(app)
-    #db.drop_all()
-    db.create_all()
 
 class User(db.Model):
     '''table for users and hosts methods for registering and authenticating'''
@@ -30,24 +30,25 @@ class User(db.Model):
     def registerAdmin(cls, email, password, organization_id):
         """register admin user with hashed password and returns user instance"""
 
-        hashed = bcrypt.generate_password_hash(password)
-        hashed_utf8 = hashed.decode("utf8")
+        hashed_utf8 = password_hasher.hash(password)
         return cls(email=email, password=hashed_utf8, organization_id=organization_id, is_admin=True)
     
     @classmethod
     def register(cls, email, password, organization_id, is_admin):
         '''registers a user'''
     
-        hashed = bcrypt.generate_password_hash(password)
-        hashed_utf8 = hashed.decode("utf8")
+        hashed_utf8 = password_hasher.hash(password)
         return cls(email=email, password=hashed_utf8, organization_id=organization_id, is_admin=is_admin)
     
     @classmethod
     def authenticate(cls, email, password):
-        """validates user information and returns instance of user or false"""
+        """validates user information and returns instance of user or false, upgrading the hash if the configured cost changed"""
 
         user = User.query.filter_by(email=email).first()
-        if user and bcrypt.check_password_hash(user.password, password):
+        if user and password_hasher.verify(user.password, password):
+            if password_hasher.needs_rehash(user.password):
+                user.password = password_hasher.hash(password)
+                db.session.commit()
             return user
         else:
             return False
@@ -62,8 +63,34 @@ class PendingUser(db.Model):
     token = db.Column(db.String(25), nullable=False, unique=True)
     expiration = db.Column(db.DateTime, nullable=False)
     pending_admin = db.Column(db.Boolean, nullable = True, default=False)
+
+    __table_args__ = (
+        db.Index('ix_pending_users_expiration', 'expiration'),
+    )
     
 
+class OutboxEmail(db.Model):
+    '''table for queued emails awaiting delivery by the outbox worker'''
+
+    __tablename__ = 'outbox_emails'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    subject = db.Column(db.String(200), nullable=False)
+    recipients = db.Column(db.Text, nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    sent_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_outbox_emails_due', 'next_attempt_at', postgresql_where=db.text('sent_at IS NULL')),
+    )
+
+    def __repr__(self):
+        return f"<OutboxEmail #{self.id}: {self.subject}, {self.recipients}>"
+
 class Organization(db.Model):
     '''table for organizations'''
 
@@ -71,6 +98,8 @@ class Organization(db.Model):
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(50), unique=True)
+    data_version = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    data_updated_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=func.now())
 
     def __repr__(self):
         return f"<Organization #{self.id}: {self.name}>"
@@ -107,17 +136,34 @@ class Profile(db.Model):
     organization_id = db.Column(db.Integer, db.ForeignKey('organizations.id', ondelete='SET NULL'), nullable=False)
     __table_args__ = (
         UniqueConstraint('linkedin_url', 'organization_id'),
+        db.Index('ix_profiles_organization_id', 'organization_id', 'id'),
+        db.Index('ix_profiles_organization_name', 'organization_id', 'last_name', 'first_name', 'id'),
     )
 
     state = db.Relationship('State')
     country = db.Relationship('Country')
+    primary = db.relationship('Role',
+                              primaryjoin="and_(Role.profile_id == Profile.id, Role.is_primary == True)",
+                              uselist=False,
+                              viewonly=True)
+    roles = db.relationship('Role', back_populates='profile', order_by='(Role.start_date.desc(), Role.id.desc())')
 
     def __repr__(self):
         return f"<Profile #{self.id}: {self.first_name} {self.last_name}, {self.linkedin_url}>"
 
+    def serialize(self):
+        '''returns a dict representation of the profile'''
+        return {
+            'id': self.id,
+            'first_name': self.first_name,
+            'last_name': self.last_name,
+            'headline': self.headline,
+            'linkedin_url': self.linkedin_url
+        }
+
     def primary_role(self):
         '''Returns the primary role of the profile'''
-        return Role.query.filter_by(profile_id=self.id, is_primary=True).first()
+        return self.primary
 
 class Function(db.Model):
     '''table for job functions'''
@@ -135,6 +181,10 @@ class RoleFunction(db.Model):
     role_id = db.Column(db.Integer, db.ForeignKey('roles.id', ondelete='SET NULL'), primary_key = True)
     function_id = db.Column(db.Integer, db.ForeignKey('functions.id', ondelete='SET NULL'), primary_key = True)
 
+    __table_args__ = (
+        db.Index('ix_role_function_function_id', 'function_id'),
+    )
+
 class Role(db.Model):
     '''table for roles - past and present'''
 
@@ -144,12 +194,19 @@ class Role(db.Model):
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id', ondelete='SET NULL'), nullable=True)
     level_id = db.Column(db.Integer, db.ForeignKey('levels.id', ondelete='SET NULL'), nullable=True)
     profile_id = db.Column(db.Integer, db.ForeignKey('profiles.id', ondelete='SET NULL'), nullable = True)
+    organization_id = db.Column(db.Integer, db.ForeignKey('organizations.id', ondelete='SET NULL'), nullable=False)
     start_date = db.Column(db.Date, nullable = False)
     end_date = db.Column(db.Date, nullable = True)
     is_primary = db.Column(db.Boolean, default=False)
 
+    __table_args__ = (
+        db.Index('ix_roles_company_level_end', 'company_id', 'level_id', 'end_date'),
+        db.Index('ix_roles_current_company_level', 'company_id', 'level_id', postgresql_where=db.text('end_date IS NULL')),
+        db.Index('ix_roles_profile_primary', 'profile_id', 'is_primary'),
+    )
+
     level = db.relationship('Level')
-    profile = db.relationship('Profile')
+    profile = db.relationship('Profile', back_populates='roles')
     company = db.relationship('Company')
     functions = db.relationship('Function', secondary='role_function')
 
@@ -165,21 +222,21 @@ class Company(db.Model):
 
     __table_args__ = (
         UniqueConstraint('domain', 'organization_id'),
+        db.Index('ix_companies_organization_id', 'organization_id', 'id'),
+        db.Index('ix_companies_organization_name', 'organization_id', 'name', 'id'),
     )
 
-    employees = db.relationship('Profile', 
-                               secondary='roles',
-                               primaryjoin=and_(id == Role.company_id,
-                                                Role.end_date == None), 
-                               backref='current_company')
-    alumni = db.relationship('Profile', 
-                               secondary='roles',
-                               primaryjoin=and_(id == Role.company_id,
-                                                Role.end_date != None), 
-                               backref='alumni_company')
     def __repr__(self):
         return f"<Company #{self.id}: {self.name}, {self.domain}>"
 
+    def serialize(self):
+        '''returns a dict representation of the company'''
+        return {
+            'id': self.id,
+            'name': self.name,
+            'domain': self.domain
+        }
+
 class Level(db.Model):
     '''table for levels of seniority'''
 
@@ -207,24 +264,96 @@ class Map(db.Model):
         return [f'{self.level.name} of {f.name}' for f in self.functions] if self.level.name != 'Chief' else [f'{self.level.name} {f.name} Officer' for f in self.functions]
     
     def generate_map_rows(self):
-        '''returns rows for a map'''
+        '''returns rows for a map from its stored cells'''
+        stored = MapCell.query.filter_by(map_id=self.id).options(
+            joinedload(MapCell.profile).selectinload(Profile.primary)
+        ).all()
+        cells = {(cell.company_id, cell.function_id): cell.profile for cell in stored}
         table = []
         for co in self.companies:
             row = [co]
             for function in self.functions:
-                role = Role.query.filter(
-                    Role.company_id == co.id,
-                    Role.level_id == self.level_id,
-                    Role.functions.any(Function.id == function.id),
-                    Role.end_date == None
-                ).first()
-                if role:                                     
-                    row.append(role.profile)
-                else:
-                    row.append(None)   
+                row.append(cells.get((co.id, function.id)))
             table.append(row)
         return table
 
+    def current_role_query(self, company_ids, function_ids):
+        '''returns the query for (company_id, function_id, role_id, profile_id) of the current roles at the map's level filling the given cells'''
+        return db.session.query(Role.company_id, RoleFunction.function_id, Role.id, Role.profile_id).join(
+            RoleFunction, RoleFunction.role_id == Role.id
+        ).filter(
+            Role.company_id.in_(company_ids),
+            Role.level_id == self.level_id,
+            RoleFunction.function_id.in_(function_ids),
+            Role.end_date == None,
+            Role.profile_id != None
+        ).order_by(Role.id)
+
+    def current_role_matrix(self, company_ids, function_ids):
+        '''returns {(company_id, function_id): (role_id, profile_id)} for the current roles filling the given cells in one grouped query'''
+        if not company_ids or not function_ids:
+            return {}
+        results = self.current_role_query(company_ids, function_ids).all()
+        matrix = {}
+        for company_id, function_id, role_id, profile_id in results:
+            matrix.setdefault((company_id, function_id), (role_id, profile_id))
+        return matrix
+
+    def refresh_cells(self, company_ids=None, function_ids=None):
+        '''recomputes the stored cells of the map, optionally limited to some of its companies and/or functions'''
+        scope = MapCell.query.filter(MapCell.map_id == self.id)
+        map_company_ids = [co.id for co in self.companies]
+        map_function_ids = [f.id for f in self.functions]
+        if company_ids is not None:
+            scope = scope.filter(MapCell.company_id.in_(company_ids))
+            map_company_ids = [id for id in map_company_ids if id in company_ids]
+        if function_ids is not None:
+            scope = scope.filter(MapCell.function_id.in_(function_ids))
+            map_function_ids = [id for id in map_function_ids if id in function_ids]
+
+        matrix = self.current_role_matrix(map_company_ids, map_function_ids)
+        if matrix:
+            scope = scope.filter(tuple_(MapCell.company_id, MapCell.function_id).notin_(list(matrix)))
+        scope.delete(synchronize_session=False)
+        if not matrix:
+            return
+        # upserted rather than reinserted so concurrent refreshes of the same cells do not collide on the primary key
+        statement = pg_insert(MapCell).values([
+            {'map_id': self.id, 'company_id': company_id, 'function_id': function_id, 'role_id': role_id, 'profile_id': profile_id}
+            for (company_id, function_id), (role_id, profile_id) in matrix.items()
+        ])
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['map_id', 'company_id', 'function_id'],
+            set_={'role_id': statement.excluded.role_id, 'profile_id': statement.excluded.profile_id}
+        ))
+
+    @classmethod
+    def refresh_all_cells(cls):
+        '''recomputes the stored cells of every contact map and returns the maps'''
+        maps = cls.query.all()
+        for map in maps:
+            map.refresh_cells()
+        return maps
+
+    def sync_cells(self, old_level_id, old_company_ids, old_function_ids):
+        '''updates the stored cells after an edit, recomputing only companies and functions that were added'''
+        if self.level_id != old_level_id:
+            self.refresh_cells()
+            return
+        company_ids = [co.id for co in self.companies]
+        function_ids = [f.id for f in self.functions]
+        MapCell.query.filter(
+            MapCell.map_id == self.id,
+            or_(MapCell.company_id.notin_(company_ids), MapCell.function_id.notin_(function_ids))
+        ).delete(synchronize_session=False)
+        added_company_ids = [id for id in company_ids if id not in old_company_ids]
+        added_function_ids = [id for id in function_ids if id not in old_function_ids]
+        if added_company_ids:
+            self.refresh_cells(company_ids=added_company_ids)
+        if added_function_ids:
+            self.refresh_cells(company_ids=[id for id in company_ids if id not in added_company_ids],
+                               function_ids=added_function_ids)
+
 class FunctionMap(db.Model):
     '''table tying functions to contact maps'''
 
@@ -240,4 +369,150 @@ class CompanyMap(db.Model):
     __tablename__ = 'company_map'
 
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id', ondelete='SET NULL'), primary_key = True)
-    map_id = db.Column(db.Integer, db.ForeignKey('maps.id', ondelete='cascade'), primary_key = True)
\ No newline at end of file
+    map_id = db.Column(db.Integer, db.ForeignKey('maps.id', ondelete='cascade'), primary_key = True)
+
+class MapCell(db.Model):
+    '''table storing the filled cells of contact maps, kept current as roles and maps change'''
+
+    __tablename__ = 'map_cells'
+
+    map_id = db.Column(db.Integer, db.ForeignKey('maps.id', ondelete='cascade'), primary_key = True)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id', ondelete='cascade'), primary_key = True)
+    function_id = db.Column(db.Integer, db.ForeignKey('functions.id', ondelete='cascade'), primary_key = True)
+    role_id = db.Column(db.Integer, db.ForeignKey('roles.id', ondelete='cascade'), nullable = False)
+    profile_id = db.Column(db.Integer, db.ForeignKey('profiles.id', ondelete='cascade'), nullable = False)
+
+    profile = db.relationship('Profile')
+
+    @classmethod
+    def refresh_for_companies(cls, company_ids, level_ids):
+        '''recomputes the cells of the given companies in every map at one of the given levels'''
+        maps = Map.query.join(CompanyMap, CompanyMap.map_id == Map.id).filter(
+            CompanyMap.company_id.in_(company_ids),
+            Map.level_id.in_(level_ids)
+        ).distinct().all()
+        for map in maps:
+            map.refresh_cells(company_ids=company_ids)
+
+class ProfileSearch(db.Model):
+    '''table storing a weighted full-text document and filter columns per profile, kept current as profiles are saved'''
+
+    __tablename__ = 'profile_search'
+
+    profile_id = db.Column(db.Integer, db.ForeignKey('profiles.id', ondelete='cascade'), primary_key = True)
+    organization_id = db.Column(db.Integer, db.ForeignKey('organizations.id', ondelete='cascade'), nullable = False)
+    level_id = db.Column(db.Integer, db.ForeignKey('levels.id', ondelete='SET NULL'), nullable = True)
+    function_ids = db.Column(ARRAY(db.Integer), nullable = False, default=list)
+    country_id = db.Column(db.String(3), nullable = True)
+    company_name = db.Column(db.String(30), nullable = True)
+    sort_name = db.Column(db.String(61), nullable = False)
+    document = db.Column(TSVECTOR, nullable = False)
+
+    __table_args__ = (
+        db.Index('ix_profile_search_document', 'document', postgresql_using='gin'),
+        db.Index('ix_profile_search_function_ids', 'function_ids', postgresql_using='gin'),
+        db.Index('ix_profile_search_organization_sort', 'organization_id', 'sort_name', 'profile_id'),
+    )
+
+    @classmethod
+    def refresh(cls, profile_ids=None):
+        '''recomputes the search rows of the given profiles, or of every profile, with one INSERT ... SELECT'''
+        function_ids = select(
+            func.coalesce(func.array_agg(RoleFunction.function_id), db.text("'{}'::integer[]"))
+        ).where(RoleFunction.role_id == Role.id).scalar_subquery()
+        def weighted(text, weight):
+            return func.setweight(func.to_tsvector('simple', func.coalesce(text, '')), weight)
+        document = (weighted(func.concat_ws(' ', Profile.first_name, Profile.last_name), 'A')
+                    .op('||')(weighted(Company.name, 'B'))
+                    .op('||')(weighted(Profile.headline, 'C'))
+                    .op('||')(weighted(Profile.city, 'D')))
+        sort_name = func.lower(func.concat_ws(' ', Profile.last_name, Profile.first_name))
+        rows = select(
+            Profile.id, Profile.organization_id, Role.level_id, function_ids, Profile.country_id, Company.name, sort_name, document
+        ).outerjoin(
+            Role, and_(Role.profile_id == Profile.id, Role.is_primary == True)
+        ).outerjoin(
+            Company, Company.id == Role.company_id
+        ).distinct(Profile.id).order_by(Profile.id, Role.start_date.desc())
+        if profile_ids is not None:
+            rows = rows.where(Profile.id.in_(profile_ids))
+        columns = ['profile_id', 'organization_id', 'level_id', 'function_ids', 'country_id', 'company_name', 'sort_name', 'document']
+        statement = pg_insert(cls).from_select(columns, rows)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['profile_id'],
+            set_={column: statement.excluded[column] for column in columns[1:]}
+        ))
+
+class CompanyTransition(db.Model):
+    '''table counting the profiles whose role history moves directly from one company to another'''
+
+    __tablename__ = 'company_transitions'
+
+    from_company_id = db.Column(db.Integer, db.ForeignKey('companies.id', ondelete='cascade'), primary_key = True)
+    to_company_id = db.Column(db.Integer, db.ForeignKey('companies.id', ondelete='cascade'), primary_key = True)
+    organization_id = db.Column(db.Integer, db.ForeignKey('organizations.id', ondelete='cascade'), nullable = False)
+    count = db.Column(db.Integer, nullable = False, default = 0)
+
+    __table_args__ = (
+        db.Index('ix_company_transitions_from_count', 'from_company_id', 'count'),
+        db.Index('ix_company_transitions_to_count', 'to_company_id', 'count'),
+    )
+
+    @classmethod
+    def pairs(cls, profile_ids=None, organization_id=None):
+        '''returns a statement selecting (from, to, organization, count) for consecutive roles at different companies'''
+        ordered = select(
+            Role.company_id,
+            func.lag(Role.company_id).over(partition_by=Role.profile_id, order_by=(Role.start_date, Role.id)).label('from_company_id')
+        )
+        if profile_ids is not None:
+            ordered = ordered.where(Role.profile_id.in_(profile_ids))
+        if organization_id is not None:
+            ordered = ordered.join(Profile, Profile.id == Role.profile_id).where(Profile.organization_id == organization_id)
+        ordered = ordered.subquery()
+        return select(
+            ordered.c.from_company_id, ordered.c.company_id, Company.organization_id, func.count()
+        ).join(Company, Company.id == ordered.c.company_id).where(
+            ordered.c.from_company_id != None,
+            ordered.c.from_company_id != ordered.c.company_id
+        ).group_by(ordered.c.from_company_id, ordered.c.company_id, Company.organization_id)
+
+    @classmethod
+    def apply(cls, profile_ids, sign):
+        '''adds (sign 1) or removes (sign -1) the transitions in the current role histories of the given profiles'''
+        rows = db.session.execute(cls.pairs(profile_ids)).all()
+        if not rows:
+            return
+        statement = pg_insert(cls).values([
+            {'from_company_id': from_id, 'to_company_id': to_id, 'organization_id': organization_id, 'count': sign * count}
+            for from_id, to_id, organization_id, count in rows
+        ])
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['from_company_id', 'to_company_id'],
+            set_={'count': cls.count + statement.excluded.count}
+        ))
+        db.session.execute(cls.__table__.delete().where(
+            cls.from_company_id.in_({from_id for from_id, to_id, organization_id, count in rows}),
+            cls.count <= 0
+        ))
+
+    @classmethod
+    def add_profiles(cls, profile_ids):
+        '''counts the transitions of profiles whose roles were just written'''
+        cls.apply(profile_ids, 1)
+
+    @classmethod
+    def remove_profiles(cls, profile_ids):
+        '''uncounts the transitions of profiles whose roles are about to change'''
+        cls.apply(profile_ids, -1)
+
+    @classmethod
+    def rebuild(cls, organization_id=None):
+        '''recomputes every transition, or those of one organization, from the role histories'''
+        delete = cls.__table__.delete()
+        if organization_id is not None:
+            delete = delete.where(cls.organization_id == organization_id)
+        db.session.execute(delete)
+        db.session.execute(pg_insert(cls).from_select(
+            ['from_company_id', 'to_company_id', 'organization_id', 'count'], cls.pairs(organization_id=organization_id)
+        ))
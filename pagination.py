@@ -0,0 +1,78 @@
+import base64
+import binascii
+import json
+from datetime import date
+from sqlalchemy import tuple_
+
+DEFAULT_PER_PAGE = 25
+MAX_PER_PAGE = 100
+
+def encode_cursor(values):
+    '''encodes the sort key of the last row on a page as an opaque url-safe cursor'''
+    return base64.urlsafe_b64encode(json.dumps(values, default=date.isoformat).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    '''returns the sort key stored in a cursor or None if it is missing or malformed'''
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+    return values if isinstance(values, list) else None
+
+def cursor_values(values, columns):
+    '''returns a decoded sort key converted to the types of columns, or None if any value does not fit its column'''
+    if not values or len(values) != len(columns):
+        return None
+    converted = []
+    for value, column in zip(values, columns):
+        kind = column.type.python_type
+        if kind is date:
+            try:
+                value = date.fromisoformat(value)
+            except (TypeError, ValueError):
+                return None
+        elif kind is int:
+            if not isinstance(value, int) or isinstance(value, bool):
+                return None
+        elif kind is str:
+            if not isinstance(value, str):
+                return None
+        else:
+            return None
+        converted.append(value)
+    return converted
+
+class KeysetPage:
+    '''one page of rows plus the cursor for the page after it and, when known, the total row count'''
+
+    def __init__(self, items, next_cursor, sort, per_page, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.sort = sort
+        self.per_page = per_page
+        self.total = total
+
+def paginate(query, columns, cursor=None, per_page=DEFAULT_PER_PAGE, descending=False, sort=None):
+    '''returns the page of query ordered by columns that starts after cursor, seeking on the sort key instead of using OFFSET'''
+    values = cursor_values(decode_cursor(cursor), columns)
+    if values:
+        keys = tuple_(*columns)
+        query = query.filter(keys < tuple_(*values) if descending else keys > tuple_(*values))
+    order = [column.desc() for column in columns] if descending else columns
+    rows = query.order_by(*order).limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor([getattr(rows[-1], column.key) for column in columns])
+    return KeysetPage(rows, next_cursor, sort, per_page)
+
+def paginate_args(query, sorts, args, default_sort='name'):
+    '''paginates query using the sort, per_page and after request arguments; sorts maps names to (columns, descending)'''
+    sort = args.get('sort', default_sort)
+    if sort not in sorts:
+        sort = default_sort
+    per_page = max(1, min(args.get('per_page', DEFAULT_PER_PAGE, type=int), MAX_PER_PAGE))
+    columns, descending = sorts[sort]
+    return paginate(query, columns, args.get('after'), per_page, descending, sort)
@@ -0,0 +1,133 @@
+from sqlalchemy import text
+from models import db
+
+TENANT_TABLES = ['companies', 'profiles', 'roles']
+STRATEGIES = ['hash', 'list']
+DEFAULT_PARTITIONS = 16
+OLD_SUFFIX = '_unpartitioned'
+MIN_SERVER_VERSION = 150000
+
+# keys into tenant tables from tables that carry organization_id become composite, since a partitioned
+# table's unique keys must include organization_id; keys from role_function, company_map and map_cells,
+# which do not, are dropped and their rows stay consistent through the code that writes them
+TENANT_FOREIGN_KEYS = [
+    ('roles', 'profile_id', 'profiles', 'ON DELETE SET NULL (profile_id)'),
+    ('roles', 'company_id', 'companies', 'ON DELETE SET NULL (company_id)'),
+    ('profile_search', 'profile_id', 'profiles', 'ON DELETE CASCADE'),
+    ('company_transitions', 'from_company_id', 'companies', 'ON DELETE CASCADE'),
+    ('company_transitions', 'to_company_id', 'companies', 'ON DELETE CASCADE'),
+]
+
+class PartitionError(ValueError):
+    '''raised when a partition layout is requested with an unknown strategy or invalid bounds'''
+
+def partition_bounds(table, strategy, partitions=DEFAULT_PARTITIONS, organization_ids=()):
+    '''returns (partition name, bound clause) for each partition of a tenant table'''
+    if strategy == 'hash':
+        if partitions < 1:
+            raise PartitionError('Hash partitioning needs at least one partition')
+        return [(f'{table}_p{i}', f'FOR VALUES WITH (MODULUS {partitions}, REMAINDER {i})') for i in range(partitions)]
+    if strategy == 'list':
+        ids = sorted({int(id) for id in organization_ids})
+        return [(f'{table}_org_{id}', f'FOR VALUES IN ({id})') for id in ids] + [(f'{table}_default', 'DEFAULT')]
+    raise PartitionError(f"Unknown partition strategy: {strategy}, use one of {', '.join(STRATEGIES)}")
+
+def check_server_version(connection):
+    '''raises PartitionError unless the server supports ON DELETE SET NULL with a column list, added in PostgreSQL 15'''
+    version = int(connection.execute(text("SELECT current_setting('server_version_num')")).scalar())
+    if version < MIN_SERVER_VERSION:
+        raise PartitionError(f'Partitioning needs PostgreSQL 15 or newer, the server is {version // 10000}')
+
+def dropped_foreign_keys(connection):
+    '''returns (table, name, definition) of the foreign keys into tenant tables that partitioning drops rather than makes composite'''
+    kept = {(table, column) for table, column, target, action in TENANT_FOREIGN_KEYS}
+    rows = connection.execute(text('''
+        SELECT c.conrelid::regclass::text AS table_name, c.conname, pg_get_constraintdef(c.oid) AS definition,
+               array(SELECT a.attname::text FROM pg_attribute a WHERE a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)) AS columns
+        FROM pg_constraint c
+        WHERE c.contype = 'f' AND c.conparentid = 0
+          AND c.confrelid::regclass::text = ANY(:tenant_tables)
+          AND c.conrelid::regclass::text <> ALL(:tenant_tables)
+        ORDER BY 1, 2'''), {'tenant_tables': TENANT_TABLES}).all()
+    return [(row.table_name, row.conname, row.definition) for row in rows
+            if not any((row.table_name, column) in kept for column in row.columns)]
+
+def partition_layout(connection):
+    '''returns {table: (partition key or None, partition count)} for the tenant tables'''
+    layout = {}
+    for table in TENANT_TABLES:
+        key, count = connection.execute(text('''
+            SELECT pg_get_partkeydef(c.oid), (SELECT count(*) FROM pg_inherits i WHERE i.inhparent = c.oid)
+            FROM pg_class c WHERE c.oid = to_regclass(:table)'''), {'table': table}).one()
+        layout[table] = (key, count)
+    return layout
+
+def table_partitions(connection, table):
+    '''returns the names of a partitioned table's partitions'''
+    return connection.execute(text('''
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname'''), {'table': table}).scalars().all()
+
+def table_constraints(connection, table):
+    '''returns (name, definition) of a table's unique constraints and its foreign keys to non-tenant tables'''
+    return connection.execute(text('''
+        SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = to_regclass(:table) AND conparentid = 0
+          AND (contype = 'u' OR (contype = 'f' AND confrelid::regclass::text <> ALL(:tenant_tables)))
+        ORDER BY conname'''), {'table': table, 'tenant_tables': TENANT_TABLES}).all()
+
+def table_indexes(connection, table):
+    '''returns the definitions of a table's indexes that do not back a constraint, as statements that also index every partition'''
+    definitions = connection.execute(text('''
+        SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i
+        WHERE i.indrelid = to_regclass(:table)
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)
+        ORDER BY i.indexrelid'''), {'table': table}).scalars().all()
+    # a partitioned parent's indexes are described ON ONLY the parent, which would leave the new partitions unindexed
+    return [definition.replace(' ON ONLY ', ' ON ', 1) for definition in definitions]
+
+def plan_partitioning(connection, strategy='hash', partitions=DEFAULT_PARTITIONS, organization_ids=()):
+    '''returns the statements that rebuild the tenant tables partitioned by organization_id, keeping their rows, keys and indexes'''
+    check_server_version(connection)
+    bounds = {table: partition_bounds(table, strategy, partitions, organization_ids) for table in TENANT_TABLES}
+    constraints = {table: table_constraints(connection, table) for table in TENANT_TABLES}
+    indexes = {table: table_indexes(connection, table) for table in TENANT_TABLES}
+    sequences = {
+        table: connection.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {'table': table}).scalar()
+        for table in TENANT_TABLES
+    }
+
+    statements = [f"LOCK TABLE {', '.join(TENANT_TABLES)} IN ACCESS EXCLUSIVE MODE"]
+    for table in TENANT_TABLES:
+        old = f'{table}{OLD_SUFFIX}'
+        statements.extend(f'ALTER TABLE {partition} RENAME TO {partition}{OLD_SUFFIX}' for partition in table_partitions(connection, table))
+        statements.append(f'ALTER TABLE {table} RENAME TO {old}')
+        statements.append(f'CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY {strategy.upper()} (organization_id)')
+        statements.extend(f'CREATE TABLE {name} PARTITION OF {table} {bound}' for name, bound in bounds[table])
+        statements.append(f'INSERT INTO {table} SELECT * FROM {old}')
+        if sequences[table]:
+            statements.append(f'ALTER SEQUENCE {sequences[table]} OWNED BY {table}.id')
+    statements.extend(f'DROP TABLE {table}{OLD_SUFFIX} CASCADE' for table in TENANT_TABLES)
+
+    for table in TENANT_TABLES:
+        statements.append(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, organization_id)')
+        statements.extend(f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition}' for name, definition in constraints[table])
+        statements.extend(indexes[table])
+    for table, column, target, action in TENANT_FOREIGN_KEYS:
+        if connection.execute(text('SELECT to_regclass(:table)'), {'table': table}).scalar() is None:
+            continue
+        statements.append(f'ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_{column}_fkey')
+        statements.append(
+            f'ALTER TABLE {table} ADD CONSTRAINT {table}_{column}_fkey FOREIGN KEY ({column}, organization_id) '
+            f'REFERENCES {target} (id, organization_id) {action}'
+        )
+    statements.extend(f'ANALYZE {table}' for table in TENANT_TABLES)
+    return statements
+
+def partition_tables(strategy='hash', partitions=DEFAULT_PARTITIONS, organization_ids=()):
+    '''moves companies, profiles and roles into tables partitioned by organization_id in one transaction and returns the statements run'''
+    with db.engine.begin() as connection:
+        statements = plan_partitioning(connection, strategy, partitions, organization_ids)
+        for statement in statements:
+            connection.exec_driver_sql(statement)
+    return statements
@@ -0,0 +1,70 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import math
+import time
+from flask import current_app
+from flask_bcrypt import Bcrypt
+
+bcrypt = Bcrypt()
+
+DEFAULT_LOG_ROUNDS = 12
+MIN_LOG_ROUNDS = 10
+MAX_LOG_ROUNDS = 16
+DEFAULT_MAX_CONCURRENCY = 4
+CALIBRATION_ROUNDS = 10
+
+class PasswordHasher:
+    '''runs bcrypt hashing and verification on a bounded thread pool at a configured or calibrated cost'''
+
+    def __init__(self):
+        self.lock = Lock()
+        self.executor = None
+        self.calibrated = {}
+
+    def _run(self, fn, *args):
+        '''runs fn on the pool; bcrypt releases the GIL, so at most BCRYPT_MAX_CONCURRENCY hashes use CPU at once'''
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=current_app.config.get('BCRYPT_MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY),
+                    thread_name_prefix='bcrypt'
+                )
+        return self.executor.submit(fn, *args).result()
+
+    def log_rounds(self):
+        '''returns BCRYPT_LOG_ROUNDS if set, else the cost calibrated for BCRYPT_TARGET_MS, else the default'''
+        rounds = current_app.config.get('BCRYPT_LOG_ROUNDS')
+        if rounds:
+            return rounds
+        target_ms = current_app.config.get('BCRYPT_TARGET_MS')
+        if not target_ms:
+            return DEFAULT_LOG_ROUNDS
+        with self.lock:
+            if target_ms not in self.calibrated:
+                self.calibrated[target_ms] = self.calibrate(target_ms)
+            return self.calibrated[target_ms]
+
+    def calibrate(self, target_ms):
+        '''returns the highest cost whose hash takes at most target_ms on this machine, within the allowed range'''
+        start = time.perf_counter()
+        bcrypt.generate_password_hash('calibration', CALIBRATION_ROUNDS)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        rounds = CALIBRATION_ROUNDS + math.floor(math.log2(target_ms / elapsed_ms))
+        return max(MIN_LOG_ROUNDS, min(MAX_LOG_ROUNDS, rounds))
+
+    def hash(self, password):
+        '''returns a utf8 bcrypt hash of password at the current cost'''
+        return self._run(bcrypt.generate_password_hash, password, self.log_rounds()).decode('utf8')
+
+    def verify(self, hashed, password):
+        '''checks password against a bcrypt hash'''
+        return self._run(bcrypt.check_password_hash, hashed, password)
+
+    def needs_rehash(self, hashed):
+        '''returns True if the hash was made at a lower cost than the current one; calibrated costs vary between workers, so hashes are never downgraded'''
+        try:
+            return int(hashed.split('$')[2]) < self.log_rounds()
+        except (IndexError, ValueError):
+            return True
+
+password_hasher = PasswordHasher()
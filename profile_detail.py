@@ -0,0 +1,20 @@
+from sqlalchemy.orm import joinedload, selectinload
+from models import db, Profile, Role
+
+def load_profile(profile_id):
+    '''returns a profile with its location and every role's company, level and functions loaded in two queries, or None'''
+    return db.session.execute(
+        db.select(Profile).options(
+            joinedload(Profile.state),
+            joinedload(Profile.country),
+            selectinload(Profile.roles).options(
+                joinedload(Role.company),
+                joinedload(Role.level),
+                joinedload(Role.functions)
+            )
+        ).where(Profile.id == profile_id)
+    ).unique().scalar_one_or_none()
+
+def primary_role(profile):
+    '''returns the primary role from a profile's loaded roles without querying'''
+    return next((role for role in profile.roles if role.is_primary), None)
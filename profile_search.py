@@ -0,0 +1,71 @@
+import re
+from sqlalchemy import func, select, literal
+from models import db, Profile, ProfileSearch
+from reference import reference_data
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MAX_TERMS = 8
+MIN_PREFIX = 2
+
+def prefix_query(text):
+    '''turns free text into a tsquery string matching every word, as a prefix once it is MIN_PREFIX long, or None if it has no words'''
+    words = re.findall(r'\w+', text.lower())[:MAX_TERMS]
+    if not words:
+        return None
+    return ' & '.join(f'{word}:*' if len(word) >= MIN_PREFIX else word for word in words)
+
+def search_profiles(organization_id, text='', level=None, function=None, country=None, limit=DEFAULT_LIMIT):
+    '''returns an organization's profiles matching text as ranked dicts, optionally filtered by level, function and country names'''
+    search = ProfileSearch.__table__.c
+    query = prefix_query(text or '')
+    if query:
+        tsquery = func.to_tsquery('simple', query)
+        rank = func.ts_rank_cd(search.document, tsquery)
+    else:
+        rank = literal(0.0)
+    matches = select(
+        search.profile_id, search.company_name, search.level_id, search.function_ids, search.sort_name, rank.label('rank')
+    ).where(search.organization_id == organization_id)
+
+    if query:
+        matches = matches.where(search.document.op('@@')(tsquery))
+    if level:
+        level_id = reference_data.level_id(level)
+        if level_id is None:
+            return []
+        matches = matches.where(search.level_id == level_id)
+    if function:
+        function_id = reference_data.function_id(function)
+        if function_id is None:
+            return []
+        matches = matches.where(search.function_ids.contains([function_id]))
+    if country:
+        matches = matches.where(search.country_id == country)
+
+    # rank and limit on the search table alone so profiles are only read for the rows returned
+    order = [search.sort_name, search.profile_id]
+    matches = matches.order_by(rank.desc(), *order) if query else matches.order_by(*order)
+    matches = matches.limit(limit).subquery()
+    statement = select(
+        Profile.id, Profile.first_name, Profile.last_name, Profile.headline, Profile.linkedin_url,
+        matches.c.company_name, matches.c.level_id, matches.c.function_ids, matches.c.rank
+    ).join(matches, matches.c.profile_id == Profile.id).order_by(
+        matches.c.rank.desc(), matches.c.sort_name, matches.c.profile_id
+    )
+
+    results = []
+    for row in db.session.execute(statement):
+        level = reference_data.level(row.level_id)
+        results.append({
+            'id': row.id,
+            'first_name': row.first_name,
+            'last_name': row.last_name,
+            'headline': row.headline,
+            'linkedin_url': row.linkedin_url,
+            'company': row.company_name,
+            'level': level.name if level else None,
+            'functions': [reference_data.function(id).name for id in row.function_ids if reference_data.function(id)],
+            'rank': round(row.rank, 4) if query else None
+        })
+    return results
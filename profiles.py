@@ -0,0 +1,193 @@
+from datetime import date
+from sqlalchemy.exc import IntegrityError
+from models import db, Profile, Role, Company, MapCell, ProfileSearch, CompanyTransition
+from reference import reference_data
+from dashboard import invalidate_dashboard
+from versioning import record_org_write
+
+REQUIRED_FIELDS = ['first_name', 'last_name', 'linkedin_url', 'company', 'level', 'functions', 'start_date', 'country']
+TEXT_FIELDS = ['first_name', 'last_name', 'linkedin_url', 'headline', 'company', 'level', 'start_date', 'city', 'state', 'country']
+MAX_LENGTHS = {'first_name': 30, 'last_name': 30, 'headline': 50, 'city': 50}
+LINKEDIN_URL_CONSTRAINT = 'profiles_linkedin_url_organization_id_key'
+
+class ProfileError(ValueError):
+    '''raised when a new profile is invalid; field names the input at fault, if any'''
+
+    def __init__(self, message, field=None):
+        super().__init__(message)
+        self.field = field
+
+def violated_constraint(error):
+    '''returns the name of the constraint an IntegrityError violated, if the driver reports it'''
+    return getattr(getattr(error.orig, 'diag', None), 'constraint_name', None)
+
+def parse_functions(value):
+    '''accepts a list of function names or a string separated by ; or |'''
+    if isinstance(value, list):
+        return [str(name).strip() for name in value if str(name).strip()]
+    return [name.strip() for name in str(value or '').replace('|', ';').split(';') if name.strip()]
+
+def parse_date(value):
+    '''accepts a date or an ISO formatted string'''
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value))
+
+class ProfileLookups:
+    '''the companies and taken linkedin urls a batch of new profiles refers to, read with one query each'''
+
+    def __init__(self, organization_id, entries):
+        domains = {entry.get('company') for entry in entries if entry and isinstance(entry.get('company'), str)}
+        urls = {entry.get('linkedin_url') for entry in entries if entry and isinstance(entry.get('linkedin_url'), str)}
+        self.company_ids = dict(db.session.query(Company.domain, Company.id).filter(
+            Company.organization_id == organization_id,
+            Company.domain.in_(domains)
+        )) if domains else {}
+        self.taken_urls = {url for (url,) in db.session.query(Profile.linkedin_url).filter(
+            Profile.organization_id == organization_id,
+            Profile.linkedin_url.in_(urls)
+        )} if urls else set()
+
+def parse_role(entry, lookups):
+    '''validates the company, level, functions and start date of an entry and returns their ids, function names and date'''
+    company_id = lookups.company_ids.get(entry['company'])
+    if not company_id:
+        raise ProfileError(f"No company exists: {entry['company']}", 'company')
+    level_id = reference_data.level_id(entry['level'])
+    if not level_id:
+        raise ProfileError(f"Unknown level: {entry['level']}", 'level')
+    function_names = list(dict.fromkeys(parse_functions(entry['functions'])))
+    if not function_names or any(reference_data.function_id(name) is None for name in function_names):
+        raise ProfileError(f"Unknown function in: {entry['functions']}", 'functions')
+    try:
+        start_date = parse_date(entry['start_date'])
+    except ValueError:
+        raise ProfileError(f"Invalid start date: {entry['start_date']}", 'start_date')
+    return company_id, level_id, function_names, start_date
+
+def build_profile(entry, organization_id, lookups):
+    '''validates one entry against the lookups and returns an unsaved (profile, primary role) pair'''
+    if not isinstance(entry, dict):
+        raise ProfileError('Row is not a JSON object')
+    missing = [field for field in REQUIRED_FIELDS if not entry.get(field)]
+    if missing:
+        raise ProfileError(f"Missing {', '.join(missing)}", missing[0])
+    invalid = [field for field in TEXT_FIELDS if isinstance(entry.get(field), list)]
+    if invalid:
+        raise ProfileError(f"Invalid {', '.join(invalid)}", invalid[0])
+    if entry['linkedin_url'] in lookups.taken_urls:
+        raise ProfileError(f"Profile already exists: {entry['linkedin_url']}", 'linkedin_url')
+    company_id, level_id, function_names, start_date = parse_role(entry, lookups)
+    if entry.get('state') and not reference_data.state(entry['state']):
+        raise ProfileError(f"Unknown state: {entry['state']}", 'state')
+    if not reference_data.country(entry['country']):
+        raise ProfileError(f"Unknown country: {entry['country']}", 'country')
+    too_long = [field for field, length in MAX_LENGTHS.items() if len(entry.get(field) or '') > length]
+    if too_long:
+        raise ProfileError(f"Too long: {', '.join(too_long)}", too_long[0])
+
+    profile = Profile(
+        first_name=entry['first_name'],
+        last_name=entry['last_name'],
+        linkedin_url=entry['linkedin_url'],
+        headline=entry.get('headline') or '',
+        city=entry.get('city') or None,
+        state_id=entry.get('state') or None,
+        country_id=entry['country'],
+        organization_id=organization_id
+    )
+    role = Role(
+        profile=profile,
+        organization_id=organization_id,
+        company_id=company_id,
+        level_id=level_id,
+        start_date=start_date,
+        end_date=None,
+        is_primary=True,
+        functions=reference_data.session_functions(function_names)
+    )
+    lookups.taken_urls.add(entry['linkedin_url'])
+    return profile, role
+
+def prepare_profiles(organization_id, entries):
+    '''resolves the lookups for every entry at once and returns ([(profile, role)], [(index, ProfileError)])'''
+    lookups = ProfileLookups(organization_id, entries)
+    built, errors = [], []
+    for index, entry in enumerate(entries):
+        try:
+            built.append(build_profile(entry, organization_id, lookups))
+        except ProfileError as e:
+            errors.append((index, e))
+    return built, errors
+
+def save_profiles(built):
+    '''writes built profiles, roles and role functions with a single flush and refreshes the map cells and search rows they affect'''
+    for profile, role in built:
+        db.session.add(role)
+    db.session.flush()
+    MapCell.refresh_for_companies(
+        list({role.company_id for profile, role in built}),
+        list({role.level_id for profile, role in built})
+    )
+    profiles = [profile for profile, role in built]
+    ProfileSearch.refresh([profile.id for profile in profiles])
+    CompanyTransition.add_profiles([profile.id for profile in profiles])
+    for organization_id in {profile.organization_id for profile in profiles}:
+        record_org_write(organization_id)
+    return profiles
+
+def create_profile(organization_id, entry):
+    '''creates a profile with its primary role and functions in one transaction; raises ProfileError if it is invalid'''
+    built, errors = prepare_profiles(organization_id, [entry])
+    if errors:
+        raise errors[0][1]
+    try:
+        profile = save_profiles(built)[0]
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        if violated_constraint(e) != LINKEDIN_URL_CONSTRAINT:
+            raise
+        raise ProfileError(f"Profile already exists: {entry['linkedin_url']}", 'linkedin_url')
+    invalidate_dashboard(organization_id)
+    return profile
+
+def add_role(organization_id, profile_id, entry):
+    '''ends a profile's current primary role and makes a new role from entry primary, updating maps, search and talent flows'''
+    profile = db.session.get(Profile, profile_id)
+    if not profile or profile.organization_id != organization_id:
+        raise ProfileError('No profile exists')
+    missing = [field for field in ['company', 'level', 'functions', 'start_date'] if not entry.get(field)]
+    if missing:
+        raise ProfileError(f"Missing {', '.join(missing)}", missing[0])
+    company_id, level_id, function_names, start_date = parse_role(entry, ProfileLookups(organization_id, [entry]))
+    current = profile.primary
+    if current and start_date <= current.start_date:
+        raise ProfileError('A new role must start after the current one', 'start_date')
+
+    CompanyTransition.remove_profiles([profile.id])
+    if current:
+        current.is_primary = False
+        current.end_date = current.end_date or start_date
+    role = Role(
+        profile=profile,
+        organization_id=organization_id,
+        company_id=company_id,
+        level_id=level_id,
+        start_date=start_date,
+        end_date=None,
+        is_primary=True,
+        functions=reference_data.session_functions(function_names)
+    )
+    db.session.add(role)
+    db.session.flush()
+    CompanyTransition.add_profiles([profile.id])
+    MapCell.refresh_for_companies(
+        list({company_id, current.company_id} if current else {company_id}),
+        list({level_id, current.level_id} if current else {level_id})
+    )
+    ProfileSearch.refresh([profile.id])
+    record_org_write(organization_id)
+    db.session.commit()
+    invalidate_dashboard(organization_id)
+    return role
@@ -0,0 +1,96 @@
+from threading import Lock
+from sqlalchemy.orm import make_transient_to_detached
+from models import db, Level, Function, State, Country
+
+class ReferenceData:
+    '''process-wide registry of the levels, functions, states and countries seeded by seed.py'''
+
+    def __init__(self):
+        self.lock = Lock()
+        self.loaded = False
+
+    def load(self):
+        '''reads every reference table once and indexes it by id and name'''
+        with self.lock:
+            self.levels = self._detached(Level, Level.id)
+            self.functions = self._detached(Function, Function.id)
+            self.states = self._detached(State, State.name)
+            self.countries = self._detached(Country, Country.name)
+            self.level_ids = {level.name: level.id for level in self.levels.values()}
+            self.function_ids = {function.name: function.id for function in self.functions.values()}
+            self.loaded = True
+
+    def reload(self):
+        '''reloads the registry after the reference tables change'''
+        self.load()
+
+    def _detached(self, model, order_by):
+        '''returns {id: instance} of detached copies that can be merged into any session without a query'''
+        instances = {}
+        for id, name in db.session.query(model.id, model.name).order_by(order_by):
+            instance = model(id=id, name=name)
+            make_transient_to_detached(instance)
+            instances[id] = instance
+        return instances
+
+    def _ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def level_id(self, name):
+        '''returns the id of the level with the given name or None'''
+        self._ensure_loaded()
+        return self.level_ids.get(name)
+
+    def function_id(self, name):
+        '''returns the id of the function with the given name or None'''
+        self._ensure_loaded()
+        return self.function_ids.get(name)
+
+    def level(self, id):
+        '''returns the level with the given id'''
+        self._ensure_loaded()
+        return self.levels.get(id)
+
+    def function(self, id):
+        '''returns the function with the given id'''
+        self._ensure_loaded()
+        return self.functions.get(id)
+
+    def state(self, id):
+        '''returns the state with the given id'''
+        self._ensure_loaded()
+        return self.states.get(id)
+
+    def country(self, id):
+        '''returns the country with the given id'''
+        self._ensure_loaded()
+        return self.countries.get(id)
+
+    def session_functions(self, names):
+        '''returns the named functions merged into the current session without querying, for assigning to relationships'''
+        self._ensure_loaded()
+        return [db.session.merge(self.functions[self.function_ids[name]], load=False)
+                for name in names if name in self.function_ids]
+
+    def level_choices(self):
+        '''returns (value, label) choices for level select fields'''
+        self._ensure_loaded()
+        return [(level.name, level.name) for level in self.levels.values()]
+
+    def function_choices(self):
+        '''returns (value, label) choices for function select fields'''
+        self._ensure_loaded()
+        return [(function.name, function.name) for function in self.functions.values()]
+
+    def state_choices(self):
+        '''returns (value, label) choices for state select fields'''
+        self._ensure_loaded()
+        return [(None, "Select State (optional)")] + [(state.id, state.name) for state in self.states.values()]
+
+    def country_choices(self):
+        '''returns (value, label) choices for country select fields'''
+        self._ensure_loaded()
+        return [('', 'Select Country')] + [(country.id, country.name) for country in self.countries.values()]
+
+reference_data = ReferenceData()
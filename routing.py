@@ -0,0 +1,54 @@
+import time
+from flask import g, request, session, current_app, has_request_context
+from flask_sqlalchemy.session import Session
+
+REPLICA_BIND = 'replica'
+READ_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+STICKY_SECONDS = 10
+PRIMARY_UNTIL_KEY = 'primary_until'
+
+class RoutingSession(Session):
+    '''sends the reads of read-only requests to the replica bind and every write, or read after a write, to the primary'''
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context() and g.get('read_replica'):
+            if self._flushing:
+                g.read_replica = False
+            else:
+                engine = self._db.engines.get(REPLICA_BIND)
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def use_primary(view):
+    '''marks a read-only view that must see writes made moments ago by other sessions'''
+    view.use_primary = True
+    return view
+
+class ReplicaRouter:
+    '''decides per request whether reads may use the replica, keeping a session on the primary for a while after it writes'''
+
+    def init_app(self, app):
+        app.config.setdefault('DB_REPLICA_STICKY_SECONDS', STICKY_SECONDS)
+        app.before_request(self._route_request)
+        app.after_request(self._remember_write)
+
+    def enabled(self):
+        return REPLICA_BIND in (current_app.config.get('SQLALCHEMY_BINDS') or {})
+
+    def _route_request(self):
+        if not self.enabled():
+            return
+        view = current_app.view_functions.get(request.endpoint)
+        g.read_replica = (
+            request.method in READ_METHODS
+            and not getattr(view, 'use_primary', False)
+            and session.get(PRIMARY_UNTIL_KEY, 0) <= time.time()
+        )
+
+    def _remember_write(self, response):
+        if self.enabled() and request.method not in READ_METHODS:
+            session[PRIMARY_UNTIL_KEY] = time.time() + current_app.config['DB_REPLICA_STICKY_SECONDS']
+        return response
+
+replica_router = ReplicaRouter()
@@ -122,4 +122,15 @@ def should_seed():
     level_count = Level.query.count()
     state_count = State.query.count()
     country_count = Country.query.count()
-    return function_count == 0 and level_count == 0 and state_count == 0 and country_count == 0
\ No newline at end of file
+    return function_count == 0 and level_count == 0 and state_count == 0 and country_count == 0
+
+def seed_reference_data():
+    '''seeds functions, levels, states and countries if none exist yet and returns whether it did'''
+
+    if not should_seed():
+        return False
+    seed_functions()
+    seed_levels()
+    seed_states()
+    seed_countries()
+    return True
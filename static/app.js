@@ -1,36 +1,124 @@
-async function getResults(input){
-    //queries api to fetch result company domains
-    const response = await $.ajax({
-        url: '/api/companies/search',
-        method: 'GET',
-        data: {q : input}
-    });
-    return response;
+const TYPEAHEAD_DELAY = 200;
+const TYPEAHEAD_LIMIT = 10;
+const TYPEAHEAD_TTL = 60000;
+
+function normalizeTerm(text){
+    //mirrors company_index.normalize: lowercases and strips the scheme and www. prefix
+    text = (text || '').trim().toLowerCase();
+    for(const prefix of ['https://', 'http://', 'www.']){
+        if(text.startsWith(prefix)){
+            text = text.slice(prefix.length);
+        }
+    }
+    return text.replace(/\/+$/, '');
 }
 
-function getHTML(results){
-    //returns html for results or button to add a company
-    if(results.length > 0){
-        console.log(results)
-        const html = results.map(result => {
-            return `<div class="list-group-item list-group-item-info">${result}</div>`;
-        });
-        return html;
-
-    }else{
-        console.log('else', results)
-        const html = '<div class="list-group-item list-group-item-primary">No companies found <a href="/companies/new"><button class="btn btn-primary btn-sm" id="open-company-form">Create Company</button></div>';
-        $(document).on('click', '#open-company-form', function(evt){
-            evt.preventDefault();
-            window.open('/companies/new', '_blank');
+function matchRank(company, term){
+    //ranks a company against term the way the server does: 0 name/domain prefix, 1 word prefix, 2 substring, -1 no match
+    const name = normalizeTerm(company.name);
+    const domain = normalizeTerm(company.domain);
+    if(name.startsWith(term) || domain.startsWith(term)){
+        return 0;
+    }
+    if(name.split(/\s+/).slice(1).some(word => word.startsWith(term))){
+        return 1;
+    }
+    if(term.length >= 3 && `${name} ${domain}`.includes(term)){
+        return 2;
+    }
+    return -1;
+}
+
+function createTypeahead(url, limit, ttl){
+    //returns a company search that caches results per term and answers narrower terms from complete broader results
+    const cache = new Map();
+    let controller = null;
+
+    function cached(term){
+        const entry = cache.get(term);
+        if(entry && Date.now() - entry.time < ttl){
+            return entry;
+        }
+        cache.delete(term);
+        return null;
+    }
+
+    function narrowed(term){
+        //filters the longest cached complete result for a prefix of term, if it must contain every match for term
+        for(let i = term.length - 1; i > 0; i--){
+            const broader = term.slice(0, i);
+            const entry = cached(broader);
+            if(entry && entry.complete && (broader.length >= 3 || term.length < 3)){
+                const companies = entry.companies
+                    .map((company, index) => ({company, index, rank: matchRank(company, term)}))
+                    .filter(match => match.rank >= 0)
+                    .sort((a, b) => a.rank - b.rank || a.index - b.index)
+                    .map(match => match.company);
+                return {companies, complete: true, time: entry.time};
+            }
+        }
+        return null;
+    }
+
+    async function search(text){
+        //resolves to the companies matching text, or null if the request failed or a newer search superseded it
+        const term = normalizeTerm(text);
+        if(!term){
+            return [];
+        }
+        let entry = cached(term) || narrowed(term);
+        if(entry){
+            cache.set(term, entry);
+            return entry.companies;
+        }
+        if(controller){
+            controller.abort();
+        }
+        controller = new AbortController();
+        const params = new URLSearchParams({q: term, limit, detail: 1});
+        try{
+            const response = await fetch(`${url}?${params}`, {signal: controller.signal, headers: {Accept: 'application/json'}});
+            //an expired session is redirected to the login page, which is not JSON
+            if(!response.ok || !(response.headers.get('Content-Type') || '').includes('application/json')){
+                return null;
+            }
+            const data = await response.json();
+            entry = {companies: data.companies, complete: data.complete, time: Date.now()};
+            cache.set(term, entry);
+            return entry.companies;
+        }catch(err){
+            return null;
+        }
+    }
+
+    return {search, clear: () => cache.clear()};
+}
+
+function debounce(fn, delay){
+    //delays fn until delay ms pass without another call
+    let timer = null;
+    return function(...args){
+        clearTimeout(timer);
+        timer = setTimeout(() => fn.apply(this, args), delay);
+    };
+}
+
+function getHTML(companies){
+    //returns result items for companies or a button to add a company
+    if(companies.length > 0){
+        return companies.map(company => {
+            return $('<div class="list-group-item list-group-item-info"></div>')
+                .attr('data-domain', company.domain)
+                .text(company.domain)
+                .attr('title', company.name);
         });
-        return [html]
     }
+    return ['<div class="list-group-item list-group-item-primary">No companies found <a href="/companies/new"><button class="btn btn-primary btn-sm" id="open-company-form">Create Company</button></a></div>'];
 }
 
 function appendResults(results){
-    //appends html for results to DOM
-    console.log('inappend');
+    //replaces the result dropdown under the company field
+    $('#result-container').remove();
     var dropdown = $('<div class="list-group" id="result-container"></div>');
     for(var result of results){
         dropdown.append(result);
@@ -39,21 +127,45 @@ function appendResults(results){
         position: 'absolute',
         width: $('#profile-form').outerWidth()
     });
-    $('#company').after(dropdown);        
+    $('#company').after(dropdown);
 }
 
 $(document).ready(function(){
-    //attaches event listener to profile form company field
-    $('#profile-form #company').on('input', async function(){
-        $('#result-container').empty()
-        const input = $(this).val();
-        const results = await getResults(input);
-        const html = getHTML(results);
-        appendResults(html);
+    //attaches a debounced, cached typeahead to the profile form company field
+    if(!$('#profile-form #company').length){
+        return;
+    }
+    const companies = createTypeahead('/api/companies/search', TYPEAHEAD_LIMIT, TYPEAHEAD_TTL);
+    let latest = '';
+
+    const lookup = debounce(async function(input){
+        const results = await companies.search(input);
+        if(input !== latest){
+            return;
+        }
+        if(results === null || !normalizeTerm(input)){
+            $('#result-container').remove();
+            return;
+        }
+        appendResults(getHTML(results));
+    }, TYPEAHEAD_DELAY);
+
+    $('#profile-form #company').on('input', function(){
+        latest = $(this).val();
         $('#profile-button').prop('disabled', true).hide();
-    })
-}
-)
+        lookup(latest);
+    });
+
+    $(document).on('click', '#open-company-form', function(evt){
+        evt.preventDefault();
+        window.open('/companies/new', '_blank');
+    });
+
+    $(window).on('focus', function(){
+        //a company may have been created in another tab
+        companies.clear();
+    });
+});
 
 $(document).ready(function() {
     //attaches event listeners to profile form result options
@@ -64,8 +176,8 @@ $(document).ready(function() {
         $(this).removeClass('list-group-item-primary').addClass('list-group-item-info');
     });
     $('#profile-form').on('click', '.list-group-item', function(){
-        if(!$(this).text().includes("No companies found")){
-            $('#company').val($(this).text());
+        if($(this).data('domain')){
+            $('#company').val($(this).data('domain'));
             $('#profile-button').prop('disabled', false).show();
         }        
         $('#result-container').empty();        
@@ -0,0 +1,23 @@
+from sqlalchemy import select, union_all, literal
+from models import db, Company, CompanyTransition
+
+FLOW_LIMIT = 10
+MAX_FLOW_LIMIT = 50
+
+def top_flows(company_id, limit=FLOW_LIMIT):
+    '''returns {'outbound': [...], 'inbound': [...]} of the companies people most often move to and come from, in one indexed read'''
+    outbound = select(
+        literal('outbound').label('direction'), CompanyTransition.to_company_id.label('company_id'), CompanyTransition.count
+    ).where(CompanyTransition.from_company_id == company_id).order_by(CompanyTransition.count.desc()).limit(limit)
+    inbound = select(
+        literal('inbound').label('direction'), CompanyTransition.from_company_id.label('company_id'), CompanyTransition.count
+    ).where(CompanyTransition.to_company_id == company_id).order_by(CompanyTransition.count.desc()).limit(limit)
+    flows = union_all(outbound, inbound).subquery()
+    statement = select(flows.c.direction, flows.c.count, Company.id, Company.name, Company.domain).join(
+        Company, Company.id == flows.c.company_id
+    ).order_by(flows.c.direction, flows.c.count.desc(), Company.name)
+
+    result = {'outbound': [], 'inbound': []}
+    for row in db.session.execute(statement):
+        result[row.direction].append({'id': row.id, 'name': row.name, 'domain': row.domain, 'count': row.count})
+    return result
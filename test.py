@@ -1,31 +1,58 @@
 from unittest import TestCase
-from seed import seed_countries, seed_functions, seed_levels, seed_states, should_seed
-from app import app, CURR_USER_KEY
-from models import db, User, Organization, Company, Profile, Role, Map, Level, Function, RoleFunction
+from seed import seed_reference_data
+from app import create_app, CURR_USER_KEY
+from models import db, User, Organization, PendingUser, OutboxEmail, Company, Profile, Role, Map, Level, Function, RoleFunction, MapCell, CompanyTransition
+from reference import reference_data
+from profiles import create_profile, add_role, ProfileError, ProfileLookups
+from generator import generate_organization
+from benchmark import run_benchmark, compare_results
+from instrumentation import query_budget, QueryBudgetExceeded
+from routing import REPLICA_BIND
+from pagination import encode_cursor
+from partitioning import partition_tables, partition_layout, dropped_foreign_keys
+from mailer import mail, send_pending
 from flask import session
+from sqlalchemy import insert, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql
+from datetime import date, datetime, timedelta
+import gzip
+import io
+import os
+import threading
+import time
+import unittest
+from unittest import mock
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///talenttree_test'
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['TESTING'] = True
-app.config['DEBUG_TB_HOSTS']=['dont-show-deubg-toolbar']
-app.config['WTF_CSRF_ENABLED'] = False
+app = create_app({
+    'SQLALCHEMY_DATABASE_URI': 'postgresql:///talenttree_test',
+    'SQLALCHEMY_ECHO': False,
+    'TESTING': True,
+    'DEBUG_TB_HOSTS': ['dont-show-deubg-toolbar'],
+    'WTF_CSRF_ENABLED': False,
+    'BCRYPT_LOG_ROUNDS': 4
+})
+
+def reset_database():
+    '''recreates the test schema with its reference data'''
+    with app.app_context():
+        db.drop_all(bind_key=None)
+        db.create_all(bind_key=None)
+        seed_reference_data()
+        reference_data.reload()
 
 class AppTestCase(TestCase):
     '''tests views for model creation'''
     @classmethod
     def setUpClass(cls):
-        with app.app_context():
-            db.drop_all()
-            db.create_all()            
-            if should_seed():
-                seed_functions()
-                seed_levels()
-                seed_states()
-                seed_countries()
+        reset_database()
     
     def setUp(self):
         '''cleanup and setup'''
         with app.app_context():
+            Map.query.delete()
+            OutboxEmail.query.delete()
+            PendingUser.query.delete()
             RoleFunction.query.delete()
             Role.query.delete()
             Company.query.delete()
@@ -62,6 +89,7 @@ class AppTestCase(TestCase):
             test_role = Role(company_id=self.company_id, 
                              level_id=Level.query.filter_by(name='Chief').first().id,
                              profile_id = self.profile_id,
+                             organization_id = self.organization_id,
                              start_date = '01/01/2001',
                              is_primary = True                            
                              )
@@ -132,6 +160,9 @@ class AppTestCase(TestCase):
             self.assertEqual(response.status_code, 200)
             html = response.get_data(as_text=True)
             self.assertIn("test org", html)
+            self.assertIn("1 contacts", html)
+            self.assertIn("Test Jones", html)
+            self.assertIn("Operations", html)
 
     def test_companies(self):
         '''tests companies routes'''
@@ -196,4 +227,745 @@ class AppTestCase(TestCase):
             response = client.get('/maps')
             self.assertEqual(response.status_code, 200)
             html = response.get_data(as_text=True)
-            self.assertIn("test org", html)
\ No newline at end of file
+            self.assertIn("test org", html)
+
+    def test_map_detail(self):
+        '''tests map detail route and incremental updates of its stored cells'''
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.email
+            response = client.post('/maps/new',
+                                   data={'name': 'Test Map', 'level': 'Chief', 'functions': ['Operations', 'Finance'], 'companies': [self.company_id]})
+            self.assertEqual(response.status_code, 302)
+            map_id = int(response.location.rsplit('/', 1)[-1])
+
+            response = client.get(f'/maps/{map_id}')
+            self.assertEqual(response.status_code, 200)
+            html = response.get_data(as_text=True)
+            self.assertIn("Chief Operations Officer", html)
+            self.assertIn("Test Jones", html)
+            self.assertIn("January 2001", html)
+            self.assertIn("add profile", html)
+            html = client.get(f'/organizations/{self.organization_id}').get_data(as_text=True)
+            self.assertIn("50% (1/2)", html)
+
+            response = client.post('/profiles/new',
+                                   data={'first_name': 'Fin', 'last_name': 'Smith', 'linkedin_url': 'https://www.linkedinfakefinance.com/', 'headline': 'CFO at Test Company',
+                                         'level': 'Chief', 'functions': ['Finance'], 'start_date': '2020-05-01',
+                                         'company': 'http://www.faketestcompany.com/', 'state': 'None', 'country': 'USA'})
+            self.assertEqual(response.status_code, 302)
+            html = client.get(f'/maps/{map_id}').get_data(as_text=True)
+            self.assertIn("Fin Smith", html)
+            self.assertNotIn("add profile", html)
+
+            response = client.post(f'/maps/{map_id}/edit',
+                                   data={'name': 'Test Map', 'level': 'Chief', 'functions': ['Finance'], 'companies': [self.company_id]})
+            self.assertEqual(response.status_code, 302)
+            with app.app_context():
+                self.assertEqual(MapCell.query.filter_by(map_id=map_id).count(), 1)
+
+        # a second transaction refreshing the same cells waits for the first and then updates them
+        errors = []
+        def refresh_concurrently():
+            with app.app_context():
+                try:
+                    db.session.get(Map, map_id).refresh_cells()
+                    db.session.commit()
+                except Exception as e:
+                    errors.append(e)
+        with app.app_context():
+            db.session.get(Map, map_id).refresh_cells()
+            thread = threading.Thread(target=refresh_concurrently)
+            thread.start()
+            time.sleep(0.3)
+            db.session.commit()
+            thread.join()
+            self.assertEqual(errors, [])
+            self.assertEqual(MapCell.query.filter_by(map_id=map_id).count(), 1)
+
+    def test_company_search(self):
+        '''tests ranked company search and index updates on company creation'''
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.email
+            response = client.get('/api/companies/search?q=test')
+            self.assertEqual(response.json, ['http://www.faketestcompany.com/'])
+
+            client.post('/companies/new', data={'name': 'Testing Labs', 'domain': 'http://testinglabs.com/'})
+            response = client.get('/api/companies/search?q=test')
+            self.assertEqual(response.json, ['http://www.faketestcompany.com/', 'http://testinglabs.com/'])
+            response = client.get('/api/companies/search?q=labs&limit=1')
+            self.assertEqual(response.json, ['http://testinglabs.com/'])
+            response = client.get('/api/companies/search?q=nomatch')
+            self.assertEqual(response.json, [])
+
+            response = client.get('/api/companies/search?q=test&limit=1&detail=1')
+            self.assertEqual(response.json, {'companies': [{'name': 'Test Company', 'domain': 'http://www.faketestcompany.com/'}], 'complete': False})
+            response = client.get('/api/companies/search?q=test&limit=2&detail=1')
+            self.assertTrue(response.json['complete'])
+
+    def test_pagination(self):
+        '''tests keyset pagination of the profiles and companies JSON endpoints'''
+        with app.app_context():
+            db.session.add(Company(name='Another Company', domain='http://www.anothertestcompany.com/', organization_id=self.organization_id))
+            db.session.commit()
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.email
+            response = client.get('/api/companies?per_page=1')
+            self.assertEqual([c['name'] for c in response.json['companies']], ['Another Company'])
+            response = client.get(f"/api/companies?per_page=1&after={response.json['next']}")
+            self.assertEqual([c['name'] for c in response.json['companies']], ['Test Company'])
+            self.assertIsNone(response.json['next'])
+            response = client.get('/api/companies?sort=recent')
+            self.assertEqual([c['name'] for c in response.json['companies']], ['Another Company', 'Test Company'])
+
+            response = client.get('/api/profiles')
+            self.assertEqual(response.json['profiles'][0]['last_name'], 'Jones')
+            response = client.get('/companies?per_page=1')
+            self.assertIn("next page", response.get_data(as_text=True))
+
+            for forged in [['a', {}], [[1], 2], [None, 'x'], [True, 1]]:
+                cursor = encode_cursor(forged)
+                response = client.get(f'/api/companies?sort=recent&after={cursor}')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json['companies']), 2)
+                self.assertEqual(client.get(f'/api/profiles?after={cursor}').status_code, 200)
+            forged = encode_cursor(['Jones', ['Test'], 'x'])
+            self.assertEqual(client.get(f'/companies/{self.company_id}?employees_after={forged}').status_code, 200)
+
+    def test_profile_import(self):
+        '''tests bulk profile import reports bad rows without aborting the batch'''
+        csv = (
+            'first_name,last_name,linkedin_url,headline,company,level,functions,start_date,city,state,country\n'
+            'Ann,Lee,https://www.linkedinfakeann.com/,VP Sales,http://www.faketestcompany.com/,Vice President,Sales;Marketing,2019-03-01,Austin,TX,USA\n'
+            'Dup,Jones,https://www.linkedinfaketestprofile.com/,CEO,http://www.faketestcompany.com/,Chief,Executive,2001-01-01,,,USA\n'
+            'No,Company,https://www.linkedinfakenoco.com/,CTO,http://www.nocompany.com/,Chief,Engineering,2015-01-01,,,USA\n'
+        )
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.email
+            response = client.post('/profiles/import', data={'file': (io.BytesIO(csv.encode()), 'profiles.csv')},
+                                   content_type='multipart/form-data')
+            self.assertEqual(response.status_code, 200)
+            html = response.get_data(as_text=True)
+            self.assertIn("Imported 1 profiles", html)
+            self.assertIn("Profile already exists", html)
+            self.assertIn("No company exists", html)
+        with app.app_context():
+            ann = Profile.query.filter_by(linkedin_url='https://www.linkedinfakeann.com/').one()
+            self.assertEqual(ann.primary_role().level.name, 'Vice President')
+            self.assertEqual(sorted(f.name for f in ann.primary_role().functions), ['Marketing', 'Sales'])
+
+    def test_create_profile(self):
+        '''tests profile creation saves the whole aggregate or nothing'''
+        entry = {'first_name': 'Ops', 'last_name': 'Lee', 'linkedin_url': 'https://www.linkedinfakeops.com/', 'headline': 'COO',
+                 'company': 'http://www.faketestcompany.com/', 'level': 'Chief', 'functions': ['Operations', 'Finance'],
+                 'start_date': date(2020, 1, 1), 'country': 'USA'}
+        with app.app_context():
+            profile = create_profile(self.organization_id, entry)
+            self.assertEqual(profile.primary_role().company.name, 'Test Company')
+            self.assertEqual(sorted(f.name for f in profile.primary_role().functions), ['Finance', 'Operations'])
+
+            with self.assertRaises(ProfileError) as e:
+                create_profile(self.organization_id, dict(entry, linkedin_url='https://www.linkedinfakenoco.com/', company='http://www.nocompany.com/'))
+            self.assertEqual(e.exception.field, 'company')
+            self.assertEqual(Profile.query.filter_by(linkedin_url='https://www.linkedinfakenoco.com/').count(), 0)
+
+            with self.assertRaises(ProfileError) as e:
+                create_profile(self.organization_id, entry)
+            self.assertEqual(e.exception.field, 'linkedin_url')
+
+            # a duplicate url written concurrently is only caught by the unique constraint, and other violations are not blamed on it
+            class RacingLookups(ProfileLookups):
+                def __init__(self, organization_id, entries):
+                    super().__init__(organization_id, entries)
+                    self.taken_urls = set()
+            class DeletedCompanyLookups(RacingLookups):
+                def __init__(self, organization_id, entries):
+                    super().__init__(organization_id, entries)
+                    self.company_ids = {domain: -1 for domain in self.company_ids}
+            with mock.patch('profiles.ProfileLookups', RacingLookups):
+                with self.assertRaises(ProfileError) as e:
+                    create_profile(self.organization_id, entry)
+                self.assertEqual(e.exception.field, 'linkedin_url')
+            with mock.patch('profiles.ProfileLookups', DeletedCompanyLookups):
+                with self.assertRaises(IntegrityError):
+                    create_profile(self.organization_id, dict(entry, linkedin_url='https://www.linkedinfakegone.com/'))
+
+    def test_company_members(self):
+        '''tests company detail sections are counted and paginated independently'''
+        with app.app_context():
+            for i in range(3):
+                create_profile(self.organization_id, {
+                    'first_name': f'Member{i}', 'last_name': 'Adams', 'headline': 'Analyst',
+                    'linkedin_url': f'https://www.linkedinfakemember{i}.com/', 'company': 'http://www.faketestcompany.com/',
+                    'level': 'Manager', 'functions': ['Finance'], 'start_date': date(2005, 1, 1), 'country': 'USA'
+                })
+            member = Profile.query.filter_by(first_name='Member2').one()
+            member.primary_role().end_date = date(2010, 1, 1)
+            db.session.add(Role(profile_id=member.id, organization_id=self.organization_id, company_id=self.company_id,
+                                level_id=member.primary_role().level_id, start_date=date(2001, 1, 1), end_date=date(2004, 1, 1)))
+            db.session.commit()
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.email
+            html = client.get(f'/companies/{self.company_id}?per_page=2').get_data(as_text=True)
+            self.assertIn("Employees (3)", html)
+            self.assertIn("Alumni (1)", html)
+            self.assertIn("Member0 Adams", html)
+            self.assertNotIn("Test Jones", html)
+            self.assertIn("Finance", html)
+            cursor = html.split('employees_after=')[1].split('&')[0]
+            html = client.get(f'/companies/{self.company_id}?per_page=2&employees_after={cursor}').get_data(as_text=True)
+            self.assertIn("Test Jones", html)
+            self.assertNotIn("Member0 Adams", html)
+            self.assertIn("Member2 Adams", html)
+
+    def test_generate_and_benchmark(self):
+        '''tests the synthetic data generator and a single benchmark pass over its organization'''
+        with app.app_context():
+            generated = generate_organization('Generated Org', companies=5, profiles=20, max_roles=3, maps=2, seed=1)
+            self.assertEqual(Profile.query.filter_by(organization_id=generated.organization_id).count(), 20)
+            self.assertEqual(Role.query.filter(Role.profile_id.in_(generated.profile_ids), Role.is_primary == True).count(), 20)
+            self.assertEqual(Map.query.filter_by(organization_id=generated.organization_id).count(), 2)
+        app.config['SQL_TIMING_HEADERS'] = False
+        try:
+            results = run_benchmark(app, generated.organization_id, iterations=2, warmup=0)
+        finally:
+            app.config['SQL_TIMING_HEADERS'] = None
+        self.assertIn('map_detail', results['routes'])
+        for result in results['routes'].values():
+            self.assertEqual(result['status'], 200)
+            self.assertGreater(result['queries'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertEqual(compare_results(results, results)[0][3], 0)
+
+    def test_query_budgets(self):
+        '''tests per-request query counts are reported and the main routes stay within their query budgets'''
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.email
+            # conditional views spend one query on the organization's data version
+            budgets = {
+                '/profiles': 4,
+                '/companies': 4,
+                f'/companies/{self.company_id}': 5,
+                f'/profiles/{self.profile_id}': 4,
+                f'/organizations/{self.organization_id}': 8,
+                '/api/companies/search?q=test': 2,
+            }
+            for url, budget in budgets.items():
+                with query_budget(budget) as counter:
+                    response = client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(int(response.headers['X-Query-Count']), counter.count)
+            with self.assertRaises(QueryBudgetExceeded):
+                with query_budget(0):
+                    client.get('/profiles')
+
+            app.config['SQL_TIMING_HEADERS'] = False
+            try:
+                response = client.get('/profiles')
+            finally:
+                app.config['SQL_TIMING_HEADERS'] = None
+            self.assertNotIn('X-Query-Count', response.headers)
+            self.assertNotIn('Server-Timing', response.headers)
+
+            html = client.get('/debug/requests').get_data(as_text=True)
+            self.assertIn(f'GET /companies/{self.company_id}', html)
+            self.assertIn('SELECT', html)
+
+    def test_profile_search(self):
+        '''tests ranked prefix search over profiles with level, function and country filters'''
+        with app.app_context():
+            for first_name, last_name, headline, level, functions in [
+                ('Sara', 'Mills', 'Head of Sales', 'Vice President', ['Sales']),
+                ('Sam', 'Salazar', 'Engineer', 'Manager', ['Engineering']),
+                ('Tom', 'Baker', 'Sales lead', 'Manager', ['Sales', 'Marketing']),
+            ]:
+                create_profile(self.organization_id, {
+                    'first_name': first_name, 'last_name': last_name, 'headline': headline, 'level': level, 'functions': functions,
+                    'linkedin_url': f'https://www.linkedinfake{first_name.lower()}.com/', 'company': 'http://www.faketestcompany.com/',
+                    'start_date': date(2020, 1, 1), 'city': 'Austin', 'country': 'USA'
+                })
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.email
+            response = client.get('/api/profiles/search?q=sa')
+            names = [p['first_name'] for p in response.json['profiles']]
+            self.assertEqual(names[:2], ['Sam', 'Sara'])
+            self.assertIn('Tom', names)
+            response = client.get('/api/profiles/search?q=sal&function=Marketing')
+            self.assertEqual([p['first_name'] for p in response.json['profiles']], ['Tom'])
+            response = client.get('/api/profiles/search?q=test+company&level=Vice+President')
+            profile = response.json['profiles'][0]
+            self.assertEqual((profile['first_name'], profile['company'], profile['functions']), ('Sara', 'Test Company', ['Sales']))
+            response = client.get('/api/profiles/search?q=austin&country=CAN')
+            self.assertEqual(response.json['profiles'], [])
+
+    def test_talent_flows(self):
+        '''tests company transitions are counted as roles change and served by the flows API and company page'''
+        with app.app_context():
+            next_co = Company(name='Next Company', domain='http://next.com/', organization_id=self.organization_id)
+            db.session.add(next_co)
+            db.session.commit()
+            next_id = next_co.id
+            add_role(self.organization_id, self.profile_id, {
+                'company': 'http://next.com/', 'level': 'President', 'functions': ['Executive'], 'start_date': date(2010, 1, 1)
+            })
+            self.assertEqual(CompanyTransition.query.one().count, 1)
+            with self.assertRaises(ProfileError):
+                add_role(self.organization_id, self.profile_id, {
+                    'company': 'http://next.com/', 'level': 'Chief', 'functions': ['Executive'], 'start_date': date(2005, 1, 1)
+                })
+            add_role(self.organization_id, self.profile_id, {
+                'company': 'http://www.faketestcompany.com/', 'level': 'Chief', 'functions': ['Executive'], 'start_date': date(2015, 1, 1)
+            })
+            counts = {(t.from_company_id, t.to_company_id): t.count for t in CompanyTransition.query}
+            self.assertEqual(counts, {(self.company_id, next_id): 1, (next_id, self.company_id): 1})
+            CompanyTransition.rebuild(self.organization_id)
+            self.assertEqual({(t.from_company_id, t.to_company_id): t.count for t in CompanyTransition.query}, counts)
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.email
+            response = client.get(f'/api/companies/{self.company_id}/flows')
+            self.assertEqual([f['name'] for f in response.json['outbound']], ['Next Company'])
+            self.assertEqual([f['count'] for f in response.json['inbound']], [1])
+            html = client.get(f'/companies/{next_id}').get_data(as_text=True)
+            self.assertIn("Talent Flow", html)
+            self.assertIn("Test Company", html)
+
+    def test_profile_history(self):
+        '''tests the profile page shows every role with a fixed number of queries'''
+        with app.app_context():
+            db.session.add(Company(name='Next Company', domain='http://next.com/', organization_id=self.organization_id))
+            db.session.commit()
+            for year, domain in [(2010, 'http://next.com/'), (2015, 'http://www.faketestcompany.com/'), (2020, 'http://next.com/')]:
+                add_role(self.organization_id, self.profile_id, {
+                    'company': domain, 'level': 'President', 'functions': ['Finance', 'Sales'], 'start_date': date(year, 1, 1)
+                })
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.email
+            with query_budget(4):
+                html = client.get(f'/profiles/{self.profile_id}').get_data(as_text=True)
+            self.assertIn("2001-01-01 - 2010-01-01", html)
+            self.assertIn("2020-01-01 - present", html)
+            self.assertEqual(html.count("Next Company"), 3)
+            self.assertEqual(client.get('/profiles/999999').status_code, 404)
+
+    def test_conditional_requests(self):
+        '''tests unchanged organization data is answered with 304 and any write changes the etag'''
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.email
+            response = client.get(f'/companies/{self.company_id}')
+            etag = response.headers['ETag']
+            self.assertEqual(response.headers['Cache-Control'], 'private, no-cache')
+            self.assertIn('Last-Modified', response.headers)
+
+            with query_budget(1):
+                response = client.get(f'/companies/{self.company_id}', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.get_data(), b'')
+            self.assertNotEqual(client.get('/companies').headers['ETag'], etag)
+            response = client.get(f'/companies/{self.company_id}', headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+            self.assertEqual(response.status_code, 200)
+
+            client.post('/companies/new', data={'name': 'Another Company', 'domain': 'http://another.com/'})
+            client.post('/maps/new', data={'name': 'Test Map', 'level': 'Chief', 'functions': ['Operations'], 'companies': [self.company_id]})
+            response = client.get(f'/companies/{self.company_id}', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers['ETag'], etag)
+
+            etag = response.headers['ETag']
+            for command in ['refresh-map-cells', 'refresh-profile-search', 'rebuild-talent-flows']:
+                self.assertEqual(app.test_cli_runner().invoke(args=[command]).exit_code, 0)
+                response = client.get(f'/companies/{self.company_id}', headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 200)
+                etag = response.headers['ETag']
+
+    def test_batch_api(self):
+        '''tests the batch API loads any number of org-scoped entities with a fixed number of queries and sparse fields'''
+        with app.app_context():
+            profile_ids = [self.profile_id] + [create_profile(self.organization_id, {
+                'first_name': f'Batch{i}', 'last_name': 'Person', 'headline': 'Engineer',
+                'linkedin_url': f'https://www.linkedin.com/in/batch-{i}', 'company': 'http://www.faketestcompany.com/',
+                'level': 'Director', 'functions': ['Engineering'], 'start_date': date(2020, 1, 1), 'state': 'CA', 'country': 'USA'
+            }).id for i in range(5)]
+            db.session.get(Profile, profile_ids[-1]).primary_role().end_date = date(2021, 1, 1)
+            other_org = Organization(name='Other Org')
+            db.session.add(other_org)
+            db.session.flush()
+            other_co = Company(name='Other Company', domain='http://other.com/', organization_id=other_org.id)
+            db.session.add(other_co)
+            db.session.commit()
+            other_id = other_co.id
+
+        with self.client as client:
+            self.assertEqual(client.get(f'/api/v1/profiles?ids={self.profile_id}').status_code, 401)
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.email
+            client.get('/api/v1/maps')
+            with query_budget(3):
+                one = client.get(f'/api/v1/profiles?ids={self.profile_id}').json
+            with query_budget(3):
+                many = client.get(f"/api/v1/profiles?ids={','.join(map(str, profile_ids))},999999").json
+            self.assertEqual(one['items'][0]['functions'], ['Executive', 'Operations'])
+            self.assertEqual([p['id'] for p in many['items']], profile_ids)
+            self.assertEqual(many['not_found'], [999999])
+            self.assertEqual(many['items'][1]['level'], 'Director')
+            self.assertEqual((many['items'][1]['state'], many['items'][1]['country']), ('California', 'The United States of America'))
+            self.assertIsNone(many['items'][0]['state'])
+
+            sparse = client.get(f'/api/v1/profiles?ids={self.profile_id}&fields=first_name,company').json
+            self.assertEqual(sparse['items'], [{'id': self.profile_id, 'first_name': 'Test', 'company': 'Test Company'}])
+            self.assertEqual(client.get('/api/v1/profiles?ids=1&fields=password').status_code, 400)
+            self.assertEqual(client.get('/api/v1/companies?ids=abc').status_code, 400)
+            self.assertEqual(client.get(f"/api/v1/companies?ids={','.join(['1'] * 50000)}").status_code, 400)
+
+            response = client.post('/api/v1/batch', json={
+                'companies': {'ids': [self.company_id, other_id], 'fields': ['name', 'employees']},
+                'profiles': {'ids': profile_ids[:2], 'fields': ['last_name']},
+                'maps': {'ids': [1]}
+            })
+            self.assertEqual(response.json['companies']['items'], [{'id': self.company_id, 'name': 'Test Company', 'employees': 5}])
+            self.assertEqual(response.json['companies']['not_found'], [other_id])
+            self.assertEqual(response.json['profiles']['items'][1], {'id': profile_ids[1], 'last_name': 'Person'})
+            self.assertEqual(response.json['maps']['not_found'], [1])
+            self.assertEqual(client.post('/api/v1/batch', json={'users': {'ids': [1]}}).status_code, 400)
+            for ids in [[True], [1.5], [None], ['1']]:
+                self.assertEqual(client.post('/api/v1/batch', json={'companies': {'ids': ids}}).status_code, 400)
+
+    def test_static_assets(self):
+        '''tests static files are served under content-hashed names as immutable and compressed, and large pages are compressed'''
+        with self.client as client:
+            html = client.get('/').get_data(as_text=True)
+            with open(os.path.join(app.static_folder, 'app.js'), 'rb') as file:
+                source = file.read()
+            src = next(part.split('"')[0] for part in html.split('src="')[1:] if part.startswith('/assets/app.'))
+            self.assertRegex(src, r'^/assets/app\.[0-9a-f]{12}\.js$')
+
+            response = client.get(src, headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+            self.assertIn('immutable', response.headers['Cache-Control'])
+            self.assertEqual(gzip.decompress(response.get_data()), source)
+            self.assertEqual(client.get(src, headers={'If-None-Match': response.headers['ETag'], 'Accept-Encoding': 'gzip'}).status_code, 304)
+            self.assertEqual(client.get(src).get_data(), source)
+            self.assertEqual(client.get('/assets/app.000000000000.js').status_code, 404)
+
+            response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(gzip.decompress(response.get_data()).decode(), html)
+            self.assertNotIn('Content-Encoding', client.get('/').headers)
+
+    def test_invite_outbox(self):
+        '''tests invites are queued in the outbox and delivered by the sender'''
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.email
+            response = client.post('/invite', data={'email': 'invited@test.com'}, follow_redirects=True)
+            self.assertIn("Successfully invited invited@test.com", response.get_data(as_text=True))
+        with app.app_context():
+            email = OutboxEmail.query.one()
+            self.assertEqual(email.recipients, 'invited@test.com')
+            self.assertIsNone(email.sent_at)
+            with mail.record_messages() as outbox:
+                self.assertEqual(send_pending(), 1)
+            self.assertEqual(outbox[0].recipients, ['invited@test.com'])
+            self.assertIn('/register/', outbox[0].body)
+            self.assertIsNotNone(OutboxEmail.query.one().sent_at)
+            self.assertEqual(send_pending(), 0)
+
+    def test_login_rehash(self):
+        '''tests login upgrades password hashes when the configured cost rises and never downgrades them'''
+        with app.app_context():
+            self.assertTrue(User.query.get(self.email).password.startswith('$2b$04$'))
+        app.config['BCRYPT_LOG_ROUNDS'] = 5
+        try:
+            with self.client as client:
+                response = client.post('/login', data={'email': self.email, 'password': 'wrong password'})
+                self.assertIn("Invalid username/password.", response.get_data(as_text=True))
+                response = client.post('/login', data={'email': self.email, 'password': 'password'})
+                self.assertEqual(response.status_code, 302)
+            with app.app_context():
+                self.assertTrue(User.query.get(self.email).password.startswith('$2b$05$'))
+            app.config['BCRYPT_LOG_ROUNDS'] = 4
+            with self.client as client:
+                client.post('/login', data={'email': self.email, 'password': 'password'})
+            with app.app_context():
+                self.assertTrue(User.query.get(self.email).password.startswith('$2b$05$'))
+        finally:
+            app.config['BCRYPT_LOG_ROUNDS'] = 4
+
+    def test_session_snapshot(self):
+        '''tests the session carries a user snapshot that privileged routes revalidate'''
+        with self.client as client:
+            client.post('/login', data={'email': self.email, 'password': 'password'})
+            with client.session_transaction() as sess:
+                snapshot = sess[CURR_USER_KEY]
+            self.assertEqual(snapshot['email'], self.email)
+            self.assertEqual(snapshot['organization_id'], self.organization_id)
+            self.assertTrue(snapshot['is_admin'])
+
+            response = client.get('/invite')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(client.get('/debug/requests').status_code, 200)
+            with app.app_context():
+                user = User.query.get(self.email)
+                user.is_admin = False
+                db.session.commit()
+            response = client.get('/debug/requests')
+            self.assertEqual(response.status_code, 302)
+            response = client.get('/invite')
+            self.assertEqual(response.status_code, 302)
+            with client.session_transaction() as sess:
+                self.assertNotIn(CURR_USER_KEY, sess)
+
+@unittest.skipUnless(os.environ.get('TEST_REPLICA_DATABASE_URL'), 'set TEST_REPLICA_DATABASE_URL to a second database to test replica routing')
+class ReplicaRoutingTestCase(TestCase):
+    '''tests read-only requests use the replica bind until the session writes'''
+
+    @classmethod
+    def setUpClass(cls):
+        reset_database()
+        cls.app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'postgresql:///talenttree_test',
+            'SQLALCHEMY_BINDS': {REPLICA_BIND: os.environ['TEST_REPLICA_DATABASE_URL']},
+            'TESTING': True,
+            'WTF_CSRF_ENABLED': False,
+            'BCRYPT_LOG_ROUNDS': 4
+        })
+        with cls.app.app_context():
+            replica = db.engines[REPLICA_BIND]
+            db.metadata.drop_all(replica)
+            db.metadata.create_all(replica)
+
+    def setUp(self):
+        with self.app.app_context():
+            Company.query.delete()
+            User.query.delete()
+            Organization.query.delete()
+            org = Organization(name='replica org')
+            db.session.add(org)
+            db.session.flush()
+            self.organization_id = org.id
+            user = User.registerAdmin('replica@test.com', 'password', org.id)
+            db.session.add(user)
+            db.session.add(Company(name='Primary Company', domain='http://primary.com/', organization_id=org.id))
+            db.session.commit()
+            with db.engines[REPLICA_BIND].begin() as connection:
+                connection.execute(Company.__table__.delete())
+                connection.execute(User.__table__.delete())
+                connection.execute(Organization.__table__.delete())
+                connection.execute(insert(Organization), {'id': org.id, 'name': 'replica org'})
+                connection.execute(insert(User), {'email': user.email, 'password': user.password, 'organization_id': org.id, 'is_admin': True})
+                connection.execute(insert(Company), {'name': 'Replica Company', 'domain': 'http://replica.com/', 'organization_id': org.id})
+
+    def test_read_your_writes(self):
+        '''tests GETs read from the replica and stick to the primary after a POST'''
+        with self.app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 'replica@test.com'
+            response = client.get('/api/companies')
+            self.assertEqual([c['name'] for c in response.json['companies']], ['Replica Company'])
+
+            client.post('/companies/new', data={'name': 'New Company', 'domain': 'http://new.com/'})
+            response = client.get('/api/companies')
+            self.assertEqual([c['name'] for c in response.json['companies']], ['New Company', 'Primary Company'])
+
+class PartitioningTestCase(TestCase):
+    '''tests moving the tenant tables into partitions keeps their rows, keys and behaviour'''
+
+    @classmethod
+    def setUpClass(cls):
+        reset_database()
+
+    @classmethod
+    def tearDownClass(cls):
+        reset_database()
+
+    def test_partition_tables(self):
+        '''tests list and then hash partitioning keep every row and the per-organization unique keys'''
+        with app.app_context():
+            org_ids = []
+            for name in ['Big Org', 'Small Org']:
+                org = Organization(name=name)
+                db.session.add(org)
+                db.session.flush()
+                db.session.add(User.registerAdmin(f'admin@{name[:3].lower()}.com', 'password', org.id))
+                db.session.add(Company(name='Shared Co', domain='http://shared.com/', organization_id=org.id))
+                db.session.commit()
+                create_profile(org.id, {
+                    'first_name': 'Part', 'last_name': name.split()[0], 'headline': 'Engineer',
+                    'linkedin_url': 'https://www.linkedin.com/in/part', 'company': 'http://shared.com/',
+                    'level': 'Director', 'functions': ['Engineering'], 'start_date': date(2020, 1, 1), 'country': 'USA'
+                })
+                org_ids.append(org.id)
+            big_id, small_id = org_ids
+            db.session.remove()
+
+            with db.engine.connect() as connection:
+                dropped = {(table, name) for table, name, definition in dropped_foreign_keys(connection)}
+            self.assertEqual(dropped, {
+                ('role_function', 'role_function_role_id_fkey'), ('company_map', 'company_map_company_id_fkey'),
+                ('map_cells', 'map_cells_company_id_fkey'), ('map_cells', 'map_cells_role_id_fkey'), ('map_cells', 'map_cells_profile_id_fkey')
+            })
+            partition_tables('list', organization_ids=[big_id])
+            with db.engine.connect() as connection:
+                self.assertEqual(partition_layout(connection)['profiles'], ('LIST (organization_id)', 2))
+                self.assertEqual(dropped_foreign_keys(connection), [])
+                self.assertEqual(connection.execute(text(f'SELECT count(*) FROM roles_org_{big_id}')).scalar(), 1)
+                self.assertEqual(connection.execute(text('SELECT organization_id FROM companies_default')).scalar(), small_id)
+
+            profile = create_profile(big_id, {
+                'first_name': 'After', 'last_name': 'Split', 'headline': 'Engineer',
+                'linkedin_url': 'https://www.linkedin.com/in/after', 'company': 'http://shared.com/',
+                'level': 'Director', 'functions': ['Engineering'], 'start_date': date(2021, 1, 1), 'country': 'USA'
+            })
+            self.assertEqual(profile.primary.organization_id, big_id)
+            with self.assertRaises(ProfileError):
+                create_profile(big_id, {
+                    'first_name': 'Again', 'last_name': 'Split', 'headline': 'Engineer',
+                    'linkedin_url': 'https://www.linkedin.com/in/after', 'company': 'http://shared.com/',
+                    'level': 'Director', 'functions': ['Engineering'], 'start_date': date(2021, 1, 1), 'country': 'USA'
+                })
+            db.session.remove()
+
+            partition_tables('hash', partitions=4)
+            with db.engine.connect() as connection:
+                self.assertEqual(partition_layout(connection)['roles'], ('HASH (organization_id)', 4))
+                self.assertFalse(connection.execute(text('''
+                    SELECT count(*) FROM pg_index WHERE NOT indisvalid''')).scalar())
+                for table in ['companies', 'profiles', 'roles']:
+                    parent = connection.execute(text(
+                        'SELECT count(*) FROM pg_index WHERE indrelid = to_regclass(:table)'), {'table': table}).scalar()
+                    self.assertGreater(parent, 1)
+                    counts = connection.execute(text('''
+                        SELECT count(x.indexrelid) FROM pg_inherits i LEFT JOIN pg_index x ON x.indrelid = i.inhrelid
+                        WHERE i.inhparent = to_regclass(:table) GROUP BY i.inhrelid'''), {'table': table}).scalars().all()
+                    self.assertEqual(counts, [parent] * 4)
+            self.assertEqual(Profile.query.filter_by(organization_id=big_id).count(), 2)
+            self.assertEqual(Role.query.filter_by(organization_id=small_id).count(), 1)
+            company_id = Company.query.filter_by(organization_id=big_id).one().id
+            db.session.remove()
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 'admin@big.com'
+            html = client.get(f'/companies/{company_id}').get_data(as_text=True)
+            self.assertIn('Employees (2)', html)
+            self.assertEqual(client.get(f'/profiles/{profile.id}').status_code, 200)
+
+class QueryPlanTestCase(TestCase):
+    '''tests that the hot tenant and map queries use indexes on a larger seeded dataset'''
+
+    ORGANIZATIONS = 20
+    COMPANIES = 200
+    PROFILES = 500
+
+    @classmethod
+    def setUpClass(cls):
+        reset_database()
+        with app.app_context():
+            levels = [l.id for l in Level.query.all()]
+            functions = [f.id for f in Function.query.all()]
+            org_ids = db.session.execute(
+                insert(Organization).returning(Organization.id, sort_by_parameter_order=True),
+                [{'name': f'plan org {i}'} for i in range(cls.ORGANIZATIONS)]
+            ).scalars().all()
+            companies = [{'name': f'Company {o}-{i}', 'domain': f'http://plan{o}-{i}.com/', 'organization_id': org_id}
+                         for o, org_id in enumerate(org_ids) for i in range(cls.COMPANIES)]
+            company_ids = db.session.execute(
+                insert(Company).returning(Company.id, sort_by_parameter_order=True), companies
+            ).scalars().all()
+            profiles = [{'first_name': f'First{i}', 'last_name': f'Last{i}', 'headline': 'Plan profile',
+                         'linkedin_url': f'https://linkedin.com/in/plan{o}-{i}', 'country_id': 'USA', 'organization_id': org_id}
+                        for o, org_id in enumerate(org_ids) for i in range(cls.PROFILES)]
+            profile_ids = db.session.execute(
+                insert(Profile).returning(Profile.id, sort_by_parameter_order=True), profiles
+            ).scalars().all()
+            roles = [{'profile_id': profile_id,
+                      'organization_id': org_ids[i // cls.PROFILES],
+                      'company_id': company_ids[(i // cls.PROFILES) * cls.COMPANIES + i % cls.COMPANIES],
+                      'level_id': levels[i % len(levels)],
+                      'start_date': date(2010, 1, 1),
+                      'end_date': None if i % 4 else date(2015, 1, 1),
+                      'is_primary': True}
+                     for i, profile_id in enumerate(profile_ids)]
+            role_ids = db.session.execute(
+                insert(Role).returning(Role.id, sort_by_parameter_order=True), roles
+            ).scalars().all()
+            db.session.execute(insert(RoleFunction), [
+                {'role_id': role_id, 'function_id': functions[i % len(functions)]} for i, role_id in enumerate(role_ids)
+            ])
+            db.session.execute(insert(PendingUser), [
+                {'email': f'pending{i}@plan.com', 'organization_id': org_ids[i % len(org_ids)], 'token': f'plantoken{i}',
+                 'expiration': datetime.now() + timedelta(hours=24 if i % 100 else -1)}
+                for i in range(2000)
+            ])
+            db.session.commit()
+            db.session.execute(text('ANALYZE'))
+            db.session.commit()
+            cls.org_id = org_ids[len(org_ids) // 2]
+            cls.company_ids = company_ids[cls.COMPANIES * 10:cls.COMPANIES * 10 + 5]
+            cls.profile_id = profile_ids[len(profile_ids) // 2]
+            cls.level_id = levels[0]
+            cls.function_ids = functions[:3]
+
+    @classmethod
+    def tearDownClass(cls):
+        with app.app_context():
+            PendingUser.query.filter(PendingUser.email.like('%@plan.com')).delete(synchronize_session=False)
+            plan_orgs = db.session.query(Organization.id).filter(Organization.name.like('plan org %'))
+            plan_profiles = db.session.query(Profile.id).filter(Profile.organization_id.in_(plan_orgs))
+            plan_roles = db.session.query(Role.id).filter(Role.profile_id.in_(plan_profiles))
+            RoleFunction.query.filter(RoleFunction.role_id.in_(plan_roles)).delete(synchronize_session=False)
+            Role.query.filter(Role.profile_id.in_(plan_profiles)).delete(synchronize_session=False)
+            Profile.query.filter(Profile.organization_id.in_(plan_orgs)).delete(synchronize_session=False)
+            Company.query.filter(Company.organization_id.in_(plan_orgs)).delete(synchronize_session=False)
+            Organization.query.filter(Organization.name.like('plan org %')).delete(synchronize_session=False)
+            db.session.commit()
+
+    def seq_scans(self, query):
+        '''returns the tables the planner reads with a sequential scan for query'''
+        statement = query.statement if hasattr(query, 'statement') else query
+        sql = str(statement.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+        plan = db.session.execute(text(f'EXPLAIN (FORMAT JSON) {sql}')).scalar()
+        scans = []
+        def walk(node):
+            if node['Node Type'] == 'Seq Scan':
+                scans.append(node['Relation Name'])
+            for child in node.get('Plans', []):
+                walk(child)
+        walk(plan[0]['Plan'])
+        return scans
+
+    def assertIndexed(self, query, tables=('profiles', 'companies', 'roles', 'role_function', 'pending_users')):
+        scans = [table for table in self.seq_scans(query) if table in tables]
+        self.assertEqual(scans, [], f'sequential scan on {scans}')
+
+    def test_tenant_lists(self):
+        '''tests organization-scoped profile and company pages'''
+        with app.app_context():
+            self.assertIndexed(Profile.query.filter_by(organization_id=self.org_id).order_by(
+                Profile.last_name, Profile.first_name, Profile.id).limit(26))
+            self.assertIndexed(Company.query.filter_by(organization_id=self.org_id).order_by(
+                Company.name, Company.id).limit(26))
+            self.assertIndexed(db.session.query(Company.id, Company.name, Company.domain).filter(
+                Company.organization_id == self.org_id))
+
+    def test_role_lookups(self):
+        '''tests map cell, primary role and company roster queries'''
+        with app.app_context():
+            map = Map(level_id=self.level_id)
+            matrix = map.current_role_query(self.company_ids, self.function_ids)
+            self.assertIndexed(matrix)
+            self.assertIndexed(Role.query.filter_by(profile_id=self.profile_id, is_primary=True))
+            self.assertIndexed(Role.query.filter(Role.company_id == self.company_ids[0], Role.end_date != None))
+
+    def test_pending_user_expiration(self):
+        '''tests expired invitation lookups'''
+        with app.app_context():
+            self.assertIndexed(PendingUser.query.filter(PendingUser.expiration < datetime.now()))
\ No newline at end of file
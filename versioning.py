@@ -0,0 +1,53 @@
+import hashlib
+from functools import wraps
+from flask import g, request, session, current_app, make_response
+from sqlalchemy import select, update, func
+from models import db, Organization
+
+def record_org_write(organization_id):
+    '''bumps the organization's data version in the current transaction; call before committing a write to its companies, profiles, roles or maps'''
+    record_org_writes([organization_id])
+
+def record_org_writes(organization_ids=None):
+    '''bumps the data version of the given organizations, or of every organization, in the current transaction; call before committing a rebuild of stored map cells, search rows or talent flows'''
+    table = Organization.__table__
+    statement = update(table).values(data_version=table.c.data_version + 1, data_updated_at=func.now())
+    if organization_ids is not None:
+        statement = statement.where(table.c.id.in_(organization_ids))
+    db.session.execute(statement)
+
+def org_data_version(organization_id):
+    '''returns (data version, last write time) of an organization with one primary key lookup'''
+    table = Organization.__table__
+    return db.session.execute(
+        select(table.c.data_version, table.c.data_updated_at).where(table.c.id == organization_id)
+    ).one_or_none() or (0, None)
+
+def make_etag(organization_id, version):
+    '''returns an etag for the requested url at the organization's data version as seen by the current user'''
+    viewer = f'{g.user.email}|{g.user.is_admin}'
+    return hashlib.sha256(f'{organization_id}|{version}|{viewer}|{request.full_path}'.encode()).hexdigest()[:20]
+
+def org_conditional(view):
+    '''answers GETs with 304 Not Modified when the cached copy's etag shows the user's organization data has not changed'''
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not g.user or request.method != 'GET' or session.get('_flashes'):
+            return view(*args, **kwargs)
+        version, updated_at = org_data_version(g.user.organization_id)
+        etag = make_etag(g.user.organization_id, version)
+        # If-Modified-Since is not honoured: its one-second resolution misses writes made in the same second and it cannot tell viewers apart
+        if request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag, weak=True)
+        if updated_at:
+            response.last_modified = updated_at
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    return wrapper